@@ -1,12 +1,33 @@
-from django.contrib import admin
-from .models import App
+from django.contrib import admin, messages
+from .builds import activate_build, previous_build
+from .models import App, Deployment
+
+class DeploymentInline(admin.TabularInline):
+    model = Deployment
+    fields = ('status', 'buildnumber', 'created_at', 'finished_at')
+    readonly_fields = fields
+    extra = 0
+    max_num = 0
+    can_delete = False
 
 @admin.register(App)
 class AppAdmin(admin.ModelAdmin):
-    list_display = ('name', 'status', 'created_at')
+    list_display = ('name', 'status', 'buildnumber', 'created_at')
     exclude = ('user',)
+    actions = ('rollback',)
+    inlines = (DeploymentInline,)
 
     def save_model(self, request, obj, form, change):
         if not change:
             obj.user = request.user
         super().save_model(request, obj, form, change)
+
+    @admin.action(description='Roll back to previous build')
+    def rollback(self, request, queryset):
+        for app in queryset:
+            buildnumber = previous_build(app)
+            if buildnumber is None:
+                self.message_user(request, f"App '{app.name}' has no earlier build", messages.WARNING)
+                continue
+            activate_build(app, buildnumber)
+            self.message_user(request, f"App '{app.name}' rolled back to build {buildnumber}")
@@ -5,4 +5,4 @@ class AppmanagerConfig(AppConfig):
     name = 'appmanager'
 
     def ready(self):
-        import appmanager.signals
\ No newline at end of file
+        import appmanager.signals
@@ -0,0 +1,340 @@
+import heapq
+import io
+import mimetypes
+import multiprocessing
+import os
+import shutil
+import struct
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pycms.cache import LRUCache
+from .conf import get_setting
+from .paths import safe_relpath
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZIP_MAGIC = b'PK\x03\x04'
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+TAR_MAGIC = b'ustar'
+# General purpose flag of zip members whose data is encrypted
+ZIP_ENCRYPTED = 0x1
+
+# Archive-backed builds keep their zip under this name inside the build directory
+ARCHIVE_NAME = '.build.zip'
+
+# Where a member's bytes sit in an archive-backed build
+Member = namedtuple('Member', ('data_offset', 'compress_size', 'file_size', 'compress_type'))
+
+# archive path -> {relpath: Member}, read from the central directory once per worker
+_indexes = LRUCache(maxsize=get_setting('ARCHIVE_INDEX_CACHE_SIZE'))
+
+# Per-thread descriptors of recently served archives
+_local = threading.local()
+
+class ArchiveError(ValueError):
+    pass
+
+class _Limits:
+    """
+    Running totals checked against MAX_BUILD_SIZE, MAX_BUILD_FILES and
+    MAX_COMPRESSION_RATIO while an archive is written out.
+    """
+
+    def __init__(self, archive_size):
+        self.max_size = get_setting('MAX_BUILD_SIZE')
+        self.max_files = get_setting('MAX_BUILD_FILES')
+        self.max_ratio = get_setting('MAX_COMPRESSION_RATIO')
+        self.archive_size = max(archive_size, 1)
+        self.size = 0
+        self.files = 0
+
+    def check(self, files, size):
+        if files > self.max_files:
+            raise ArchiveError(f"Build has more than {self.max_files} files")
+        if size > self.max_size:
+            raise ArchiveError(f"Build expands to more than {self.max_size} bytes")
+        if size / self.archive_size > self.max_ratio:
+            raise ArchiveError(f"Build expands more than {self.max_ratio} times its archive size")
+
+    def add_file(self):
+        self.files += 1
+        self.check(self.files, self.size)
+
+    def add_bytes(self, count):
+        self.size += count
+        self.check(self.files, self.size)
+
+def extract_archive(path, dest, workers=None, pool=None):
+    """
+    Extract a zip, tar, tar.gz or tar.zst build archive into dest and return
+    the seconds spent in each phase.
+
+    Tar archives are read as a stream, never seeking back. Zip members are
+    spread over a pool of EXTRACT_WORKERS threads or processes (workers and
+    pool override the settings). Every format is checked against the
+    extraction limits, so a malicious or broken archive is stopped before it
+    fills the disk.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(262)
+    magic = header[:4]
+    limits = _Limits(os.path.getsize(path))
+    timings = {}
+    started = time.perf_counter()
+    if magic == ZIP_MAGIC:
+        _extract_zip(path, dest, limits, timings, workers, pool)
+        return timings
+    if magic.startswith(GZIP_MAGIC):
+        with open(path, 'rb') as f:
+            _extract_tar(f, 'r|gz', dest, limits)
+    elif magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ArchiveError("Extracting .tar.zst builds requires the zstandard module")
+        with open(path, 'rb') as f, zstandard.ZstdDecompressor().stream_reader(f) as stream:
+            _extract_tar(stream, 'r|', dest, limits)
+    elif header[257:262] == TAR_MAGIC:
+        with open(path, 'rb') as f:
+            _extract_tar(f, 'r|', dest, limits)
+    else:
+        raise ArchiveError("Build file is not a zip or tar archive")
+    timings['extract'] = time.perf_counter() - started
+    return timings
+
+def _relpath(name):
+    try:
+        return safe_relpath(name)
+    except ValueError as e:
+        raise ArchiveError(str(e))
+
+def _target(dest, name):
+    return os.path.join(dest, _relpath(name))
+
+def _write(source, target, limits, chunk_size=64 * 1024):
+    limits.add_file()
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as out:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            limits.add_bytes(len(chunk))
+            out.write(chunk)
+
+def _extract_zip(path, dest, limits, timings, workers=None, pool=None):
+    started = time.perf_counter()
+    try:
+        with zipfile.ZipFile(path) as zip_ref:
+            members = [info for info in zip_ref.infolist() if not info.is_dir()]
+    except zipfile.BadZipFile as e:
+        raise ArchiveError(f"Corrupt build archive: {e}")
+    # The central directory declares every size up front and zipfile never
+    # reads a member past its declared size, so checking here covers the whole extraction
+    limits.check(len(members), sum(info.file_size for info in members))
+    targets = [(info.filename, _target(dest, info.filename), info.compress_size) for info in members]
+    timings['scan'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for directory in sorted({os.path.dirname(target) for _, target, _ in targets}):
+        os.makedirs(directory, exist_ok=True)
+    timings['mkdirs'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    workers = workers or get_setting('EXTRACT_WORKERS') or min(4, os.cpu_count() or 1)
+    if workers > 1 and len(targets) >= get_setting('EXTRACT_PARALLEL_MIN_FILES'):
+        parts = _partition(targets, workers)
+        with _executor(pool or get_setting('EXTRACT_POOL'), len(parts)) as executor:
+            for _ in executor.map(_extract_zip_members, [path] * len(parts), parts):
+                pass
+    else:
+        _extract_zip_members(path, [(name, target) for name, target, _ in targets])
+    timings['extract'] = time.perf_counter() - started
+
+def _partition(targets, workers):
+    """
+    Split members into at most workers groups of similar compressed size,
+    largest first, so no worker is left decompressing alone at the end.
+    """
+    parts = [(0, i, []) for i in range(min(workers, len(targets)))]
+    for name, target, size in sorted(targets, key=lambda t: t[2], reverse=True):
+        total, i, members = heapq.heappop(parts)
+        members.append((name, target))
+        heapq.heappush(parts, (total + size, i, members))
+    return [members for _, _, members in parts]
+
+def _executor(pool, workers):
+    if pool == 'process':
+        # Spawned rather than forked: the deploy runs on a thread of a multi-threaded server
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+    return ThreadPoolExecutor(workers, thread_name_prefix='appmanager-extract')
+
+def _extract_zip_members(path, members):
+    """
+    Write the given (name, target) members; runs once per worker with its own
+    handle on the archive. Directories must already exist.
+    """
+    try:
+        with zipfile.ZipFile(path) as zip_ref:
+            for name, target in members:
+                with zip_ref.open(name) as source, open(target, 'wb') as out:
+                    shutil.copyfileobj(source, out)
+    except zipfile.BadZipFile as e:
+        raise ArchiveError(f"Corrupt build archive: {e}")
+
+def _extract_tar(fileobj, mode, dest, limits):
+    try:
+        with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+            for member in tar:
+                # Links and special files are skipped: a build only needs regular files
+                if not member.isfile():
+                    continue
+                target = _target(dest, member.name)
+                limits.check(limits.files, limits.size + member.size)
+                _write(tar.extractfile(member), target, limits)
+    except (tarfile.TarError, EOFError) as e:
+        raise ArchiveError(f"Corrupt build archive: {e}")
+
+def link_archive(path, dest):
+    """
+    Stage a zip build to be served straight from the archive instead of
+    extracting it: the zip is hardlinked into dest as ARCHIVE_NAME and only
+    index.html is written out, for the template loader. Returns the manifest
+    entries of its members, or None if the archive cannot be served this way
+    (not a zip, encrypted members or members compressed with something other
+    than deflate).
+    """
+    with open(path, 'rb') as f:
+        if f.read(4) != ZIP_MAGIC:
+            return None
+    limits = _Limits(os.path.getsize(path))
+    try:
+        with zipfile.ZipFile(path) as zip_ref:
+            members = [info for info in zip_ref.infolist() if not info.is_dir()]
+            if any(info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) for info in members):
+                return None
+            if any(info.flag_bits & ZIP_ENCRYPTED for info in members):
+                return None
+            limits.check(len(members), sum(info.file_size for info in members))
+            files = {}
+            for info in members:
+                relpath = _relpath(info.filename)
+                files[relpath] = {
+                    'size': info.file_size,
+                    'mtime': int(time.mktime(info.date_time + (0, 0, -1))),
+                    # Hashing every member would mean decompressing the whole build;
+                    # the CRC and size validate it just as well for ETags
+                    'hash': f'{info.CRC:08x}{info.file_size:x}',
+                    'content_type': mimetypes.guess_type(info.filename)[0],
+                    'encodings': {},
+                }
+                if relpath == 'index.html':
+                    with zip_ref.open(info) as source, open(os.path.join(dest, 'index.html'), 'wb') as out:
+                        shutil.copyfileobj(source, out)
+    except zipfile.BadZipFile as e:
+        raise ArchiveError(f"Corrupt build archive: {e}")
+    target = os.path.join(dest, ARCHIVE_NAME)
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
+    return files
+
+def zip_index(path):
+    """
+    Return {relpath: Member} for an archive-backed build, parsing its central
+    directory and local headers only the first time the archive is seen.
+    """
+    index = _indexes.get(path)
+    if index is None:
+        index = {}
+        with open(path, 'rb') as f, zipfile.ZipFile(f) as zip_ref:
+            for info in zip_ref.infolist():
+                if info.is_dir():
+                    continue
+                # The local header's name and extra field lengths can differ from the central directory's
+                f.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack('<HH', f.read(4))
+                data_offset = info.header_offset + 30 + name_length + extra_length
+                index[_relpath(info.filename)] = Member(
+                    data_offset, info.compress_size, info.file_size, info.compress_type
+                )
+        _indexes.set(path, index)
+    return index
+
+def open_member(path, relpath):
+    """
+    Open a member of an archive-backed build for reading, using the cached
+    index and this thread's descriptor for the archive.
+    """
+    member = zip_index(path)[relpath]
+    return MemberReader(_archive_fd(path), member)
+
+def _archive_fd(path):
+    handles = getattr(_local, 'handles', None)
+    if handles is None:
+        handles = _local.handles = OrderedDict()
+    fd = handles.get(path)
+    if fd is None:
+        fd = handles[path] = os.open(path, os.O_RDONLY)
+        while len(handles) > get_setting('ARCHIVE_HANDLES'):
+            os.close(handles.popitem(last=False)[1])
+    else:
+        handles.move_to_end(path)
+    return fd
+
+class MemberReader(io.RawIOBase):
+    """
+    Read-only stream of one member's decompressed bytes, fetched with pread so
+    the shared descriptor's position never matters. Members up to
+    STREAM_THRESHOLD compressed bytes are read in one call when opened; larger
+    ones stream from a duplicate of the descriptor that closes with the reader,
+    so evicting the shared handle never cuts a response short.
+    """
+    STREAM_THRESHOLD = 1024 * 1024
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fd, member):
+        self.size = member.file_size
+        self._position = member.data_offset
+        self._end = member.data_offset + member.compress_size
+        self._decompressor = zlib.decompressobj(-15) if member.compress_type == zipfile.ZIP_DEFLATED else None
+        self._buffer = b''
+        self._fd = None
+        if member.compress_size <= self.STREAM_THRESHOLD:
+            if member.compress_size:
+                self._fill(os.pread(fd, member.compress_size, self._position))
+        else:
+            self._fd = os.dup(fd)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer and self._position < self._end:
+            self._fill(os.pread(self._fd, min(self.CHUNK_SIZE, self._end - self._position), self._position))
+        count = min(len(buffer), len(self._buffer))
+        buffer[:count] = self._buffer[:count]
+        self._buffer = self._buffer[count:]
+        return count
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        super().close()
+
+    def _fill(self, raw):
+        if not raw:
+            raise ArchiveError("Archive member is truncated")
+        self._position += len(raw)
+        if self._decompressor is None:
+            self._buffer += raw
+            return
+        self._buffer += self._decompressor.decompress(raw)
+        if self._position >= self._end:
+            self._buffer += self._decompressor.flush()
@@ -0,0 +1,324 @@
+import asyncio
+import contextlib
+import datetime
+import io
+import os
+import platform
+import random
+import resource
+import shutil
+import socketserver
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref import simple_server
+import django
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import override_settings
+
+WORDS = ('const', 'function', 'return', 'export', 'import', 'default', 'props', 'state',
+         'render', 'div', 'span', 'className', 'onClick', 'value', 'null', 'true')
+
+def synthetic_build(files=2000, size=8192, seed=0):
+    """
+    Return {relpath: bytes} shaped like a bundled front-end: an index.html
+    plus many hashed, text-like assets of about size bytes spread over a
+    few directories. Seeded, so every run benchmarks the same content.
+    """
+    rng = random.Random(seed)
+    build = {'index.html': b'<!doctype html><html><body><div id="root"></div></body></html>'}
+    for i in range(files - 1):
+        words = []
+        length = 0
+        target = rng.randint(size // 2, size * 3 // 2)
+        while length < target:
+            word = rng.choice(WORDS) + str(rng.randint(0, 999))
+            words.append(word)
+            length += len(word) + 1
+        ext = rng.choice(('js', 'css', 'json', 'svg'))
+        build[f'static/{ext}/chunk{i // 100}/part{i}.{rng.getrandbits(32):08x}.{ext}'] = ' '.join(words).encode()
+    return build
+
+def write_zip(path, files):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+
+def measure(func, repeat=3):
+    """
+    Call func() repeat times, each in a fresh scratch directory passed as its
+    argument, and return the wall-clock durations in seconds.
+    """
+    samples = []
+    for _ in range(repeat):
+        scratch = tempfile.mkdtemp(prefix='appmanager-bench-')
+        try:
+            started = time.perf_counter()
+            func(scratch)
+            samples.append(time.perf_counter() - started)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return samples
+
+def median(samples):
+    return statistics.median(samples)
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of samples (pct from 0 to 100).
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+def summarize(elapsed, latencies, queries=None):
+    """
+    Throughput, latency percentiles (ms), queries per call and the peak RSS
+    of the process so far for one benchmark mode, ready for JSON output.
+    """
+    summary = {
+        'calls': len(latencies),
+        'elapsed': round(elapsed, 4),
+        'per_second': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'peak_rss_mib': peak_rss_mib(),
+    }
+    if queries is not None:
+        summary['queries_per_call'] = round(queries / len(latencies), 2) if latencies else None
+    return summary
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the queries that pass through it.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+@contextlib.contextmanager
+def count_queries():
+    """
+    Yield a QueryCounter of the queries run inside the block on this
+    thread's connections and on every connection opened meanwhile, which
+    covers the threads a benchmark starts.
+    """
+    counter = QueryCounter()
+    wrapped = []
+
+    def attach(sender, connection, **kwargs):
+        connection.execute_wrappers.append(counter)
+        wrapped.append(connection)
+
+    for connection in connections.all(initialized_only=True):
+        attach(None, connection)
+    connection_created.connect(attach, weak=False)
+    try:
+        yield counter
+    finally:
+        connection_created.disconnect(attach)
+        for connection in wrapped:
+            if counter in connection.execute_wrappers:
+                connection.execute_wrappers.remove(counter)
+
+def run_metadata():
+    """
+    What a result was measured on, so runs can be compared across commits.
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'cpus': os.cpu_count(),
+        'database': connections['default'].vendor,
+    }
+
+@contextlib.contextmanager
+def scratch_site():
+    """
+    Point templates, media and builds at a scratch directory, the default
+    database at a throwaway one and caches at process memory, with deploys
+    run inline, and yield an owner for benchmark apps. Nothing a benchmark
+    creates reaches the site's own files, database or shared cache.
+    """
+    from users.models import User
+
+    scratch = tempfile.mkdtemp(prefix='appmanager-bench-')
+    templates_dir = os.path.join(scratch, 'webapps')
+    templates = [dict(settings.TEMPLATES[0], DIRS=[templates_dir])]
+    app_manager = dict(getattr(settings, 'APP_MANAGER', {}), DEPLOY_ASYNC=False)
+    caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    try:
+        with override_settings(TEMPLATES_DIR=templates_dir, MEDIA_ROOT=os.path.join(scratch, 'media'),
+                               TEMPLATES=templates, APP_MANAGER=app_manager, CACHES=caches), \
+                scratch_database(os.path.join(scratch, 'db.sqlite3')):
+            yield User.objects.create(username='bench')
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+@contextlib.contextmanager
+def scratch_database(path):
+    """
+    Swap the default database for a migrated SQLite one at path. Threads
+    started inside the block connect to it too; the connection of the
+    calling thread is set aside and restored afterwards.
+    """
+    from django.core.management import call_command
+
+    original, original_settings = connections[DEFAULT_DB_ALIAS], connections.settings[DEFAULT_DB_ALIAS]
+    connections.settings[DEFAULT_DB_ALIAS] = sqlite_settings(path)
+    connections[DEFAULT_DB_ALIAS] = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        call_command('migrate', verbosity=0)
+        yield
+    finally:
+        connections[DEFAULT_DB_ALIAS].close()
+        connections.settings[DEFAULT_DB_ALIAS] = original_settings
+        connections[DEFAULT_DB_ALIAS] = original
+
+def sqlite_settings(path, tuned=False):
+    """
+    The default database's settings pointed at a SQLite file, plain or set up
+    the way SQLITE_PRODUCTION sets up the default one.
+    """
+    database = dict(connections.settings[DEFAULT_DB_ALIAS], ENGINE='django.db.backends.sqlite3', NAME=path,
+                    CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False, OPTIONS={})
+    if tuned:
+        database.update(settings.SQLITE_PRODUCTION_DATABASE)
+    return database
+
+def create_app(user, build_file=None):
+    from .models import App
+
+    name = f'bench-{uuid.uuid4().hex[:8]}'
+    return App.objects.create(
+        user=user, name=name, repo_url='https://example.com/bench', subdomain=name, build_file=build_file
+    )
+
+def zip_upload(files):
+    buffer = io.BytesIO()
+    write_zip(buffer, files)
+    return SimpleUploadedFile('build.zip', buffer.getvalue())
+
+@contextlib.contextmanager
+def deployed_app(files):
+    """
+    Deploy files as a throwaway app in a scratch_site() and yield its name.
+    """
+    with scratch_site() as user:
+        yield create_app(user, zip_upload(files)).name
+
+@contextlib.contextmanager
+def wsgi_server():
+    """
+    Serve the project's WSGI application on a local port from a thread per
+    request and yield its base URL.
+    """
+    class Server(socketserver.ThreadingMixIn, simple_server.WSGIServer):
+        daemon_threads = True
+
+    class Handler(simple_server.WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = simple_server.make_server('127.0.0.1', 0, get_wsgi_application(), Server, Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@contextlib.contextmanager
+def sqlite_database(alias, tuned):
+    """
+    Register a throwaway, migrated SQLite database as alias, set up the way
+    SQLITE_PRODUCTION sets up the default one when tuned, and plain
+    otherwise. Yields the owner every benchmark app should belong to.
+    """
+    from django.core.management import call_command
+    from users.models import User
+
+    scratch = tempfile.mkdtemp(prefix='appmanager-bench-')
+    database = sqlite_settings(os.path.join(scratch, 'db.sqlite3'), tuned)
+    pragmas = settings.SQLITE_PRODUCTION_PRAGMAS if tuned else {}
+    retries = settings.SQLITE_WRITE_RETRIES if tuned else 0
+    connections.settings[alias] = database
+    try:
+        with override_settings(SQLITE_PRAGMAS=pragmas, SQLITE_WRITE_RETRIES=retries):
+            call_command('migrate', database=alias, verbosity=0)
+            yield User.objects.db_manager(alias).create(username='bench')
+    finally:
+        connections[alias].close()
+        del connections.settings[alias]
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def drive_threads(call, targets, concurrency):
+    """
+    Call call(target) for every target from concurrency threads, like a
+    threaded WSGI server. Returns the elapsed seconds and per-call latencies.
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def timed(target):
+        started = time.perf_counter()
+        call(target)
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(timed, targets))
+    return time.perf_counter() - started, latencies
+
+def drive_async(call, targets, concurrency):
+    """
+    Await call(target) for every target with at most concurrency in flight
+    on one event loop, like an ASGI worker. Returns the elapsed seconds and
+    per-call latencies.
+    """
+    async def run():
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(target):
+            async with semaphore:
+                started = time.perf_counter()
+                await call(target)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(timed(target) for target in targets))
+        return time.perf_counter() - started, latencies
+
+    return asyncio.run(run())
@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import os
+import time
+import uuid
+from django.conf import settings
+from .compression import ENCODINGS, compress, enabled_encodings, is_compressible
+from .conf import get_setting
+from .manifest import read_manifest
+
+logger = logging.getLogger(__name__)
+
+def store_dir():
+    # Next to TEMPLATES_DIR by default (<TEMPLATES_DIR>-blobs): on the same filesystem,
+    # so builds can hardlink to blobs, but outside the namespace of app directories
+    return get_setting('BLOB_STORE_DIR') or os.path.normpath(settings.TEMPLATES_DIR) + '-blobs'
+
+def blob_path(digest):
+    return os.path.join(store_dir(), digest[:2], digest)
+
+def has_blob(digest):
+    return os.path.exists(blob_path(digest))
+
+def add_blob(chunks, expected=None):
+    """
+    Stream chunks into a temporary file, hashing while writing, and return the
+    digest. The content only enters the store if its digest is expected (or
+    nothing was expected), so rejected uploads leave nothing behind.
+    """
+    os.makedirs(store_dir(), exist_ok=True)
+    tmp_path = os.path.join(store_dir(), f'.upload-{uuid.uuid4().hex}')
+    hasher = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                hasher.update(chunk)
+                f.write(chunk)
+        digest = hasher.hexdigest()
+        blob = blob_path(digest)
+        if expected in (None, digest) and not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(tmp_path, blob)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return digest
+
+def materialize(build_path, files):
+    """
+    Assemble a build from stored blobs by hardlinking them to their paths.
+    files maps relative paths to content hashes; raises FileNotFoundError if a blob is missing.
+    """
+    for relpath, digest in files.items():
+        path = os.path.join(build_path, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.link(blob_path(digest), path)
+
+def _link(src, dst):
+    """
+    Atomically replace dst with a hardlink to src.
+    """
+    tmp_path = f'{dst}.{uuid.uuid4().hex}.tmp'
+    os.link(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+def _store(path, blob):
+    """
+    Make path and blob the same file: link path to the existing blob (freeing
+    its own copy), or add path to the store as a new blob.
+    """
+    try:
+        _link(blob, path)
+        return
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    try:
+        os.link(path, blob)
+    except FileExistsError:
+        # Another deploy stored the same content in the meantime
+        _link(blob, path)
+
+def store_build(build_path, files):
+    """
+    Deduplicate a scanned build against the content-addressed blob store and
+    add precompressed variants to it.
+
+    Every file becomes a hardlink to the blob named after its sha256, so content
+    shared between builds and apps is stored once. Variants are stored under the
+    hash of the file they encode, so unchanged files are never recompressed.
+    Build files must therefore never be modified in place.
+    """
+    encodings = enabled_encodings()
+    linked = True
+    for relpath, entry in files.items():
+        path = os.path.join(build_path, relpath)
+        blob = blob_path(entry['hash'])
+        if linked:
+            try:
+                _store(path, blob)
+            except OSError:
+                logger.warning("Hardlinks into %s are not supported; storing builds as plain copies", store_dir())
+                linked = False
+        if not is_compressible(relpath, entry['size']):
+            continue
+        data = None
+        for encoding, suffix in encodings:
+            variant_path = path + suffix
+            if linked:
+                try:
+                    _link(blob + suffix, variant_path)
+                    entry['encodings'][encoding] = os.path.getsize(variant_path)
+                    continue
+                except FileNotFoundError:
+                    pass
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            compressed = compress(data, encoding)
+            if compressed is None:
+                continue
+            with open(variant_path, 'wb') as f:
+                f.write(compressed)
+            entry['encodings'][encoding] = len(compressed)
+            if linked:
+                try:
+                    os.link(variant_path, blob + suffix)
+                except FileExistsError:
+                    pass
+
+def build_blobs(build_path, buildnumber):
+    """
+    Paths of the blobs a build's files and precompressed variants may be
+    linked to, from its manifest.
+    """
+    manifest = read_manifest(build_path, buildnumber) or {'files': {}}
+    suffixes = dict(ENCODINGS)
+    paths = set()
+    for entry in manifest['files'].values():
+        blob = blob_path(entry['hash'])
+        paths.add(blob)
+        paths.update(blob + suffixes[encoding] for encoding in entry.get('encodings', {}))
+    return paths
+
+def collect_garbage(blobs=None):
+    """
+    Delete blobs that no build links to any more, i.e. whose only remaining
+    link is the store's own entry. Recent blobs are spared so uploads for a
+    delta deploy survive until the deploy is committed.
+
+    Deploys and deletes pass the build_blobs() of the builds they removed,
+    so their cost does not grow with the store; without blobs the whole
+    store is swept, which is left to maintenance.py.
+    """
+    cutoff = time.time() - get_setting('BLOB_GC_GRACE')
+    if blobs is None:
+        blobs = (os.path.join(root, filename) for root, _, filenames in os.walk(store_dir()) for filename in filenames)
+    for path in blobs:
+        try:
+            stat = os.stat(path)
+            if stat.st_nlink == 1 and stat.st_mtime < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
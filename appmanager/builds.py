@@ -0,0 +1,298 @@
+import contextlib
+import datetime
+import fcntl
+import functools
+import logging
+import os
+import shutil
+import time
+import uuid
+from django.db import transaction
+from django.utils import timezone
+from pycms.db import retry_on_locked
+from .archives import extract_archive, link_archive
+from .blobs import build_blobs, collect_garbage, store_build
+from .cache import invalidate_app
+from .conf import get_setting
+from .manifest import read_manifest, scan_build, write_manifest
+from .models import App, Deployment
+from .paths import BUILDS_DIRNAME, app_dir, build_dir, builds_dir, list_builds
+from .tasks import enqueue, map_parallel
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = '.deploy.lock'
+
+def new_staging_dir(app_name):
+    """
+    Create a private directory to assemble a build in before it is activated.
+    """
+    path = os.path.join(builds_dir(app_name), f'.staging-{uuid.uuid4().hex}')
+    os.makedirs(path)
+    return path
+
+def next_buildnumber(current=None):
+    """
+    Buildnumbers are deploy timestamps, bumped past the current one so two
+    deploys within the same second still get distinct builds.
+    """
+    return max(int(time.time()), (current or 0) + 1)
+
+def finalize_build(build_path, buildnumber, hashes=None):
+    """
+    Steps shared by every deploy path once the build's files are in place:
+    deduplicate them into the blob store, add precompressed variants and
+    write the build manifest.
+    """
+    files = scan_build(build_path, hashes)
+    store_build(build_path, files)
+    write_manifest(build_path, buildnumber, files)
+
+def reclaim_stale_deployments(app_pks=None):
+    """
+    Fail deploys left queued or running for over DEPLOY_STALE_AFTER seconds,
+    e.g. by a worker that restarted with them in its in-memory queue, and
+    mark apps they left deploying as failed. Limited to app_pks if given.
+    Returns the number of deploys reclaimed.
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=get_setting('DEPLOY_STALE_AFTER'))
+    stale = Deployment.objects.filter(status__in=('queued', 'running'), created_at__lt=cutoff)
+    if app_pks is not None:
+        stale = stale.filter(app_id__in=app_pks)
+    stale_app_pks = set(stale.values_list('app_id', flat=True))
+    if not stale_app_pks:
+        return 0
+    reclaimed = _update(stale.filter(app_id__in=stale_app_pks), status='failed', finished_at=timezone.now())
+    active = Deployment.objects.filter(app_id__in=stale_app_pks, status__in=('queued', 'running'))
+    stuck = App.objects.filter(pk__in=stale_app_pks, status='deploying').exclude(pk__in=active.values('app_id'))
+    names = list(stuck.values_list('name', flat=True))
+    _update(App.objects.filter(name__in=names, status='deploying'), status='failed')
+    for name in names:
+        logger.warning("Reclaimed stale deploys of app '%s'", name)
+        invalidate_app(name)
+    return reclaimed
+
+def schedule_deploy(app, staging_dir=None, hashes=None):
+    """
+    Queue a deploy of app's build_file, or of the build a multi-file or delta
+    deploy assembled in staging_dir, to run once the current transaction
+    commits. Deploys of the app still waiting in the queue are superseded,
+    so a burst of deploys only extracts and activates the newest one.
+    """
+    reclaim_stale_deployments([app.pk])
+    app.deployments.filter(status='queued').update(status='superseded')
+    deployment = Deployment.objects.create(app_id=app.pk)
+    App.objects.filter(pk=app.pk).update(status='deploying')
+    app.status = 'deploying'
+    transaction.on_commit(lambda: enqueue(run_deployment, deployment.pk, staging_dir, hashes))
+    return deployment
+
+def schedule_deploys(apps):
+    """
+    schedule_deploy() of the build files of many apps, with one query per
+    step for the whole batch. Returns the Deployments in the order of apps.
+    Without DEPLOY_ASYNC the batch still deploys side by side, on
+    map_parallel() threads the request waits for.
+    """
+    pks = [app.pk for app in apps]
+    reclaim_stale_deployments(pks)
+    Deployment.objects.filter(app_id__in=pks, status='queued').update(status='superseded')
+    deployments = Deployment.objects.bulk_create([Deployment(app_id=pk) for pk in pks])
+    App.objects.filter(pk__in=pks).update(status='deploying')
+    for app in apps:
+        app.status = 'deploying'
+    if get_setting('DEPLOY_ASYNC'):
+        for deployment in deployments:
+            transaction.on_commit(functools.partial(enqueue, run_deployment, deployment.pk))
+    elif deployments:
+        transaction.on_commit(
+            functools.partial(map_parallel, run_deployment, [deployment.pk for deployment in deployments])
+        )
+    return deployments
+
+def remove_app_files(app_name, build_file_path=None):
+    """
+    Delete everything kept on disk for an app: its builds and its uploaded
+    archive. Returns the blobs its builds used, for collect_garbage().
+    """
+    garbage = set()
+    for buildnumber in list_builds(app_name):
+        garbage |= build_blobs(build_dir(app_name, buildnumber), buildnumber)
+    shutil.rmtree(app_dir(app_name), ignore_errors=True)
+    if build_file_path:
+        try:
+            os.remove(build_file_path)
+        except OSError:
+            pass
+    return garbage
+
+@contextlib.contextmanager
+def deploy_lock(app_name):
+    """
+    Hold the app's deploy lock, an exclusive flock shared by every worker
+    process, while builds of the app are activated or pruned.
+    """
+    os.makedirs(builds_dir(app_name), exist_ok=True)
+    with open(os.path.join(builds_dir(app_name), LOCK_NAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def run_deployment(deployment_pk, staging_dir=None, hashes=None):
+    """
+    Carry out a queued deploy on the worker pool, one deploy per app at a
+    time. A deploy superseded while it waited is dropped before any
+    extraction. Moves App.status to running or failed.
+    """
+    deployment = Deployment.objects.select_related('app').filter(pk=deployment_pk).first()
+    if deployment is None:
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        return
+    with deploy_lock(deployment.app.name):
+        claimed = _update(Deployment.objects.filter(pk=deployment_pk, status='queued'), status='running')
+        app = App.objects.filter(pk=deployment.app_id).first()
+        if not claimed or app is None:
+            logger.info("Skipping superseded deploy %s of app '%s'", deployment_pk, deployment.app.name)
+            if staging_dir:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            return
+        files = None
+        try:
+            if staging_dir is None:
+                staging_dir = new_staging_dir(app.name)
+                files = extract_build_file(app, staging_dir)
+            buildnumber = _activate(app, staging_dir, hashes, files)
+        except Exception:
+            if staging_dir:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            _fail(app)
+            _update(Deployment.objects.filter(pk=deployment_pk), status='failed', finished_at=timezone.now())
+            return
+        _update(
+            Deployment.objects.filter(pk=deployment_pk),
+            status='succeeded', buildnumber=buildnumber, finished_at=timezone.now()
+        )
+        # The new build is live from here on: housekeeping failures are not deploy failures
+        try:
+            prune_builds(app.name, buildnumber)
+        except Exception:
+            logger.exception("Pruning builds of app '%s' failed", app.name)
+
+def extract_build_file(app, staging_dir):
+    """
+    Write the app's uploaded archive into staging_dir. Returns the manifest
+    entries when the build is served from the archive, None once extracted.
+    """
+    if not app.build_file:
+        raise ValueError(f"App '{app.name}' has no build file")
+    files = link_archive(app.build_file.path, staging_dir) if app.serve_from_archive else None
+    if files is None:
+        timings = extract_archive(app.build_file.path, staging_dir)
+        logger.info("Extracted %s build: %s", app.name, ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in timings.items()))
+    return files
+
+def prune_builds(app_name, active):
+    """
+    Delete builds beyond BUILD_RETENTION, never the active one. The previous
+    build is always kept since other workers may serve it until they notice
+    the switch.
+    """
+    builds = list_builds(app_name)
+    retained = set(builds[-max(2, get_setting('BUILD_RETENTION')):]) | {active}
+    garbage = set()
+    for buildnumber in builds:
+        if buildnumber not in retained:
+            garbage |= build_blobs(build_dir(app_name, buildnumber), buildnumber)
+            shutil.rmtree(build_dir(app_name, buildnumber), ignore_errors=True)
+    if garbage:
+        collect_garbage(garbage)
+    if len(builds) > 1:
+        # Files of the flat layout used before versioned build directories
+        root = app_dir(app_name)
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name == BUILDS_DIRNAME:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+def previous_build(app):
+    """
+    Return the newest retained build older than the active one, or None.
+    """
+    older = [b for b in list_builds(app.name) if b < (app.buildnumber or 0)]
+    return older[-1] if older else None
+
+def build_history(app):
+    """
+    Describe the retained builds of app, newest first.
+    """
+    history = []
+    for buildnumber in reversed(list_builds(app.name)):
+        manifest = read_manifest(build_dir(app.name, buildnumber), buildnumber) or {'files': {}}
+        files = manifest['files'].values()
+        history.append({
+            'buildnumber': buildnumber,
+            'deployed_at': datetime.datetime.fromtimestamp(buildnumber, tz=datetime.timezone.utc),
+            'files': len(files),
+            'size': sum(f['size'] for f in files),
+            'active': buildnumber == app.buildnumber,
+        })
+    return history
+
+def activate_build(app, buildnumber):
+    """
+    Point app at an already extracted build. Nothing is copied or extracted,
+    so rolling back costs the same whatever the size of the build.
+    """
+    with deploy_lock(app.name):
+        if buildnumber not in list_builds(app.name):
+            raise ValueError(f"Build {buildnumber} of app '{app.name}' is not retained")
+        last_deployed = timezone.now()
+        _update(
+            App.objects.filter(pk=app.pk),
+            buildnumber=buildnumber, status='running', last_deployed=last_deployed
+        )
+    app.buildnumber = buildnumber
+    app.status = 'running'
+    app.last_deployed = last_deployed
+    # update() bypasses the signals, so drop the cached entry here
+    invalidate_app(app.name)
+
+def _activate(app, staging_dir, hashes=None, files=None):
+    """
+    Turn a fully written staging directory into a new build and make it live.
+    The directory is renamed into place before App.buildnumber is flipped,
+    so readers only ever see complete builds and activation is O(1).
+    Archive-backed builds pass their manifest entries as files and skip the
+    scan and blob store.
+    """
+    buildnumber = next_buildnumber(max([app.buildnumber or 0] + list_builds(app.name)))
+    if files is None:
+        finalize_build(staging_dir, buildnumber, hashes)
+    else:
+        write_manifest(staging_dir, buildnumber, files)
+    os.rename(staging_dir, build_dir(app.name, buildnumber))
+    _update(
+        App.objects.filter(pk=app.pk),
+        buildnumber=buildnumber, status='running', last_deployed=timezone.now()
+    )
+    # update() bypasses the signals, so drop the cached entry here
+    invalidate_app(app.name)
+    return buildnumber
+
+def _fail(app):
+    logger.exception("Deploying app '%s' failed", app.name)
+    _update(App.objects.filter(pk=app.pk), status='failed')
+    invalidate_app(app.name)
+
+@retry_on_locked
+def _update(queryset, **values):
+    # Deploy workers write while requests are being served; a locked
+    # database is waited out rather than failing a finished deploy
+    return queryset.update(**values)
@@ -0,0 +1,138 @@
+import os
+from collections import namedtuple
+from asgiref.sync import sync_to_async
+from pycms.cache import LRUCache
+from .archives import ARCHIVE_NAME
+from .conf import get_setting
+from .models import App
+from .paths import app_dir, build_dir
+
+# What serve_static_app needs to know about an app without touching the database
+# (last_deployed is a Unix timestamp: unlike buildnumber it never goes back on a rollback)
+AppEntry = namedtuple(
+    'AppEntry',
+    ('pk', 'name', 'buildnumber', 'last_deployed', 'build_dir', 'index_templates', 'cache_index', 'archive'),
+)
+
+_NOT_CACHED = object()
+
+_apps = LRUCache(
+    maxsize=get_setting('APP_CACHE_SIZE'),
+    stamp_key='appmanager:apps:stamp',
+    check_interval=get_setting('APP_CACHE_CHECK_INTERVAL'),
+)
+
+# app pk -> (buildnumber, rendered index.html bytes)
+_indexes = LRUCache(maxsize=get_setting('INDEX_CACHE_SIZE'))
+
+# subdomain -> app name for every app, as a single table under one key
+_subdomains = LRUCache(
+    maxsize=1,
+    stamp_key='appmanager:subdomains:stamp',
+    check_interval=get_setting('APP_CACHE_CHECK_INTERVAL'),
+)
+
+def resolve_app(app_name):
+    """
+    Return the AppEntry for app_name, or None if no such app exists.
+    Both hits and misses are cached, so repeat requests skip the database.
+    """
+    entry = _apps.get(app_name, _NOT_CACHED)
+    if entry is _NOT_CACHED:
+        version = _apps.version
+        entry = _load_entry(app_name)
+        _apps.set(app_name, entry, version=version)
+    return entry
+
+async def aresolve_app(app_name):
+    """
+    resolve_app() for async views: hits are answered from memory, only a
+    miss goes to the database on a worker thread.
+    """
+    entry = await _apps.aget(app_name, _NOT_CACHED)
+    if entry is _NOT_CACHED:
+        entry = await sync_to_async(resolve_app)(app_name)
+    return entry
+
+def invalidate_app(app_name=None):
+    """
+    Forget cached state for app_name (or all apps) in this and every other worker.
+    """
+    _apps.invalidate(app_name)
+
+def app_for_subdomain(subdomain):
+    """
+    Return the name of the app served on subdomain, or None. The whole table
+    is loaded with one query and kept until an app's subdomain changes.
+    """
+    table = _subdomains.get('table')
+    if table is None:
+        version = _subdomains.version
+        table = {sub.lower(): name for sub, name in App.objects.values_list('subdomain', 'name')}
+        _subdomains.set('table', table, version=version)
+    return table.get(subdomain.lower())
+
+async def aapp_for_subdomain(subdomain):
+    """
+    app_for_subdomain() for async code; only loading the table touches the database.
+    """
+    table = await _subdomains.aget('table')
+    if table is None:
+        return await sync_to_async(app_for_subdomain)(subdomain)
+    return table.get(subdomain.lower())
+
+def invalidate_subdomains():
+    """
+    Rebuild the subdomain table on next use, in this and every other worker.
+    """
+    _subdomains.invalidate()
+
+def cached_index(app, render):
+    """
+    Return the rendered index.html of the app's active build, calling render()
+    only the first time a buildnumber is seen. Deploying a new build
+    replaces the entry, so stale pages never outlive their build.
+    """
+    cached = _indexes.get(app.pk)
+    if cached is not None and cached[0] == app.buildnumber:
+        return cached[1]
+    content = render()
+    _indexes.set(app.pk, (app.buildnumber, content))
+    return content
+
+async def acached_index(app, render):
+    """
+    cached_index() for async views; render() runs on a worker thread.
+    """
+    cached = await _indexes.aget(app.pk)
+    if cached is not None and cached[0] == app.buildnumber:
+        return cached[1]
+    return await sync_to_async(cached_index)(app, render)
+
+def _load_entry(app_name):
+    row = App.objects.filter(name=app_name).values_list('pk', 'buildnumber', 'last_deployed', 'cache_index').first()
+    if row is None:
+        return None
+    pk, buildnumber, last_deployed, cache_index = row
+    path = build_dir(app_name, buildnumber)
+    archive = None
+    if buildnumber and os.path.isdir(path):
+        index_templates = (f'{app_name}/builds/{buildnumber}/index.html',)
+        if os.path.exists(os.path.join(path, ARCHIVE_NAME)):
+            archive = os.path.join(path, ARCHIVE_NAME)
+    else:
+        # Deployed before versioned build directories: files live in the app directory
+        path = app_dir(app_name)
+        index_templates = (f'{app_name}/index.html',)
+        if buildnumber:
+            index_templates = (f'{app_name}/index_{buildnumber}.html',) + index_templates
+    return AppEntry(
+        pk=pk,
+        name=app_name,
+        buildnumber=buildnumber,
+        last_deployed=int(last_deployed.timestamp()) if last_deployed else None,
+        build_dir=path,
+        index_templates=index_templates,
+        cache_index=cache_index,
+        archive=archive,
+    )
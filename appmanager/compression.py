@@ -0,0 +1,91 @@
+import gzip
+import os
+from .conf import get_setting
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content codings we precompress, in order of preference, with their file suffixes
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+def _gzip(data):
+    # mtime=0 keeps the output (and so its ETag) identical across deploys
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def _brotli(data):
+    return brotli.compress(data, quality=11)
+
+def _compressors():
+    compressors = {'gzip': _gzip}
+    if brotli is not None and get_setting('BROTLI'):
+        compressors['br'] = _brotli
+    return compressors
+
+def enabled_encodings():
+    """
+    Return the (encoding, suffix) pairs to precompress with, best first.
+    .br variants are only written when the brotli module is installed.
+    """
+    compressors = _compressors()
+    return [(encoding, suffix) for encoding, suffix in ENCODINGS if encoding in compressors]
+
+def is_compressible(path, size):
+    return (
+        size >= get_setting('COMPRESS_MIN_SIZE')
+        and os.path.splitext(path)[1].lower() in get_setting('COMPRESSIBLE_EXTENSIONS')
+    )
+
+def compress(data, encoding):
+    """
+    Return data compressed with encoding, or None if that would not save space.
+    """
+    compressed = _compressors()[encoding](data)
+    if len(compressed) >= len(data):
+        return None
+    return compressed
+
+def compressed_variants(path, filenames):
+    """
+    Return {encoding: variant path} for the siblings of path listed in filenames.
+    """
+    name = os.path.basename(path)
+    return {
+        encoding: path + suffix
+        for encoding, suffix in ENCODINGS
+        if name + suffix in filenames
+    }
+
+def is_variant(filename, filenames):
+    return any(
+        filename.endswith(suffix) and filename[:-len(suffix)] in filenames
+        for _, suffix in ENCODINGS
+    )
+
+def choose_encoding(accept_encoding, available):
+    """
+    Pick the best of the available encodings allowed by an Accept-Encoding
+    header, or None to serve the original file.
+    """
+    if not available or not accept_encoding:
+        return None
+    qualities = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding, _ in ENCODINGS:
+        if encoding not in available:
+            continue
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
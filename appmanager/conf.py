@@ -0,0 +1,73 @@
+from django.conf import settings
+
+DEFAULTS = {
+    # Number of app name lookups kept in memory per worker
+    "APP_CACHE_SIZE": 256,
+    # Seconds between checks of the cross-worker invalidation stamp
+    "APP_CACHE_CHECK_INTERVAL": 1.0,
+    # Number of build manifests kept in memory per worker
+    "MANIFEST_CACHE_SIZE": 64,
+    # Number of rendered index.html pages kept in memory per worker
+    "INDEX_CACHE_SIZE": 64,
+    # Asset file names matching this are content-hashed and cached as immutable
+    "HASHED_ASSET_PATTERN": r"[.-](?=[A-Za-z0-9_]*[0-9])[A-Za-z0-9_]{8,}\.",
+    # Cache-Control max-age (seconds) for hashed assets, other assets and index.html;
+    # 0 means clients must revalidate on every use
+    "HASHED_ASSET_MAX_AGE": 31536000,
+    "ASSET_MAX_AGE": 0,
+    "INDEX_MAX_AGE": 0,
+    # Precompressed .gz/.br variants are written at deploy for these file types
+    "COMPRESSIBLE_EXTENSIONS": (".js", ".css", ".json", ".svg", ".webmanifest", ".txt"),
+    "COMPRESS_MIN_SIZE": 1024,
+    # Also write .br variants when the brotli module is installed
+    "BROTLI": True,
+    # Content-addressed store that build files are hardlinked to (defaults to <TEMPLATES_DIR>-blobs)
+    "BLOB_STORE_DIR": None,
+    # Seconds an unreferenced blob is kept, leaving time to commit a delta deploy
+    "BLOB_GC_GRACE": 3600,
+    # Seconds before an unfinished chunked upload is discarded
+    "UPLOAD_EXPIRY": 86400,
+    # Extracted builds kept on disk per app for rollbacks (at least 2: the active and the previous one)
+    "BUILD_RETENTION": 5,
+    # Extraction limits for uploaded build archives: total uncompressed bytes,
+    # number of files and uncompressed/compressed size ratio
+    "MAX_BUILD_SIZE": 512 * 1024 * 1024,
+    "MAX_BUILD_FILES": 20000,
+    "MAX_COMPRESSION_RATIO": 100,
+    # Zip builds with at least EXTRACT_PARALLEL_MIN_FILES members are extracted by
+    # this many workers (None: one per CPU, up to 4); EXTRACT_POOL is "thread" or "process"
+    "EXTRACT_WORKERS": None,
+    "EXTRACT_POOL": "thread",
+    "EXTRACT_PARALLEL_MIN_FILES": 64,
+    # Archive-backed builds: central-directory indexes kept per worker and
+    # open archive descriptors kept per thread
+    "ARCHIVE_INDEX_CACHE_SIZE": 32,
+    "ARCHIVE_HANDLES": 16,
+    # Serve each app on <App.subdomain>.<this domain> as well (None: only under /apps/<name>/)
+    "SUBDOMAIN_BASE_DOMAIN": None,
+    # Route /apps/<name>/ to the async serving view (for ASGI deployments)
+    "ASYNC_SERVING": False,
+    # Scripts, stylesheets and fonts from index.html announced in preload Link
+    # headers (and so 103 Early Hints where a CDN or proxy supports them); 0 disables
+    "PRELOAD_MAX_HINTS": 8,
+    # Let the front-end server send asset files: "nginx" (X-Accel-Redirect to
+    # SENDFILE_URL_PREFIX, an internal location aliasing TEMPLATES_DIR) or
+    # "apache" (X-Sendfile, also understood by lighttpd); None sends them from Django
+    "SENDFILE_BACKEND": None,
+    "SENDFILE_URL_PREFIX": "/_webapps/",
+    # Apps listed per page by the API, by default and at most (?page_size=)
+    "APP_PAGE_SIZE": 50,
+    "APP_MAX_PAGE_SIZE": 500,
+    # Run deploys on a background thread pool instead of inside the request. The queue
+    # lives in the worker's memory: deploys it held when the worker stopped are
+    # failed once older than DEPLOY_STALE_AFTER seconds (see reclaim_stale_deployments)
+    "DEPLOY_ASYNC": False,
+    "DEPLOY_WORKERS": 2,
+    "DEPLOY_STALE_AFTER": 3600,
+    # Bulk endpoints: apps accepted per call and threads for their filesystem work
+    "BULK_MAX_APPS": 100,
+    "BULK_WORKERS": 4,
+}
+
+def get_setting(name):
+    return getattr(settings, "APP_MANAGER", {}).get(name, DEFAULTS[name])
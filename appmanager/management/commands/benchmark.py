@@ -0,0 +1,305 @@
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+import zipfile
+from asgiref.sync import sync_to_async
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from rest_framework.test import APIClient
+from appmanager import bench
+from appmanager.archives import extract_archive
+from appmanager.models import App, Deployment
+from appmanager.views import aserve_static_app, serve_static_app
+from pycms.db import retry_on_locked
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark appmanager hot paths on synthetic builds; --json records the results "
+        "with the commit they were measured on, so runs can be compared"
+    )
+
+    # Options each suite depends on, recorded with its results
+    PARAMETERS = {
+        'extract': ('files', 'size', 'workers', 'pool', 'repeat'),
+        'serve': ('files', 'size', 'requests', 'concurrency'),
+        'deploy': ('files', 'size', 'deploys', 'concurrency'),
+        'sqlite': ('requests', 'concurrency', 'writers'),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=list(self.PARAMETERS))
+        parser.add_argument('--files', type=int, default=2000, help="Files in the synthetic build")
+        parser.add_argument('--size', type=int, default=8192, help="Average file size in bytes")
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+        parser.add_argument('--pool', choices=['thread', 'process'], default='thread')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--requests', type=int, default=2000, help="Requests per serve mode")
+        parser.add_argument('--concurrency', type=int, default=50, help="Requests in flight per mode")
+        parser.add_argument('--deploys', type=int, default=20, help="Deploys per deploy mode")
+        parser.add_argument('--writers', type=int, default=2, help="Threads deploying during the sqlite suite")
+        parser.add_argument('--json', metavar='PATH', help="Also write the results as JSON to PATH (- for stdout)")
+
+    def handle(self, *args, **options):
+        suite = options['suite']
+        # With JSON on stdout, the table goes to stderr
+        self.out = self.stderr if options['json'] == '-' else self.stdout
+        report = {
+            'suite': suite,
+            'parameters': {name: options[name] for name in self.PARAMETERS[suite]},
+            'run': bench.run_metadata(),
+            'results': getattr(self, f'run_{suite}')(**options),
+        }
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def run_extract(self, files, size, workers, pool, repeat, **options):
+        """
+        zipfile.extractall against extract_archive at each worker count.
+        """
+        results = {}
+        workdir = tempfile.mkdtemp(prefix='appmanager-bench-')
+        try:
+            archive = os.path.join(workdir, 'build.zip')
+            build = bench.synthetic_build(files, size)
+            bench.write_zip(archive, build)
+            self.out.write(
+                f"extract: {files} files, {sum(map(len, build.values())) / 2**20:.1f} MiB "
+                f"in a {os.path.getsize(archive) / 2**20:.1f} MiB zip, median of {repeat} runs"
+            )
+
+            def extractall(dest):
+                with zipfile.ZipFile(archive) as zip_ref:
+                    zip_ref.extractall(dest)
+
+            baseline = bench.median(bench.measure(extractall, repeat))
+            results['zipfile.extractall'] = {'median_s': round(baseline, 4)}
+            self.out.write(f"  {'zipfile.extractall':<28}{baseline:8.3f}s")
+            for count in workers:
+                phases = {}
+
+                def extract(dest):
+                    phases.update(extract_archive(archive, dest, workers=count, pool=pool))
+
+                elapsed = bench.median(bench.measure(extract, repeat))
+                results[f'{pool} workers={count}'] = {
+                    'median_s': round(elapsed, 4),
+                    'speedup': round(baseline / elapsed, 3),
+                    'phases': {phase: round(seconds, 4) for phase, seconds in phases.items()},
+                }
+                detail = ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in phases.items())
+                self.out.write(
+                    f"  {f'{pool} workers={count}':<28}{elapsed:8.3f}s {baseline / elapsed:6.2f}x  ({detail})"
+                )
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return results
+
+    def run_serve(self, files, size, requests, concurrency, **options):
+        """
+        Index and asset requests against the sync view on a thread pool (WSGI),
+        the sync view bounced through sync_to_async (ASGI without async
+        serving), the async view on one event loop, and over HTTP through
+        the whole middleware stack of a local threaded WSGI server.
+        """
+        build = bench.synthetic_build(files, size)
+        results = {}
+        with bench.deployed_app(build) as name, bench.wsgi_server() as base_url:
+            rng = random.Random(0)
+            paths = sorted(path for path in build if path != 'index.html')
+            targets = [None if rng.random() < 0.1 else rng.choice(paths) for _ in range(requests)]
+            factory, async_factory = RequestFactory(), AsyncRequestFactory()
+
+            def check(subpath, response, body):
+                # Every file of the synthetic build, index.html included, has content
+                if response.status_code != 200 or not body:
+                    raise CommandError(
+                        f"Serving {subpath or 'index.html'} returned {response.status_code} with {len(body)} bytes"
+                    )
+
+            def fetch(subpath):
+                response = serve_static_app(factory.get(f'/apps/{name}/{subpath or ""}'), name, subpath)
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                response.close()
+                check(subpath, response, body)
+
+            async def afetch(subpath):
+                response = await aserve_static_app(async_factory.get(f'/apps/{name}/{subpath or ""}'), name, subpath)
+                if response.streaming:
+                    body = b''.join([chunk async for chunk in response.streaming_content])
+                else:
+                    body = response.content
+                check(subpath, response, body)
+
+            async def fetch_in_thread(subpath):
+                await sync_to_async(fetch, thread_sensitive=False)(subpath)
+
+            def fetch_http(subpath):
+                with urllib.request.urlopen(f'{base_url}/apps/{name}/{subpath or ""}') as response:
+                    response.read()
+
+            fetch(None)
+            fetch_http(None)
+            self.out.write(f"serve: {requests} requests, {concurrency} in flight, {files} file build")
+            for mode, drive in (
+                ('wsgi', lambda: bench.drive_threads(fetch, targets, concurrency)),
+                ('asgi sync view', lambda: bench.drive_async(fetch_in_thread, targets, concurrency)),
+                ('asgi async view', lambda: bench.drive_async(afetch, targets, concurrency)),
+                ('wsgi server', lambda: bench.drive_threads(fetch_http, targets, concurrency)),
+            ):
+                with bench.count_queries() as queries:
+                    elapsed, latencies = drive()
+                results[mode] = bench.summarize(elapsed, latencies, queries.count)
+                self.report(mode, results[mode], 'req/s')
+        return results
+
+    def run_deploy(self, files, size, deploys, concurrency, **options):
+        """
+        Deploys through AppViewSet.deploy with the test client, deploys running
+        inline so each call covers extraction and activation: a zip build
+        file, and the same build uploaded as individual files.
+        """
+        build = bench.synthetic_build(files, size)
+        archive = io.BytesIO()
+        bench.write_zip(archive, build)
+        results = {}
+        self.out.write(f"deploy: {deploys} deploys per mode, {concurrency} in flight, {files} file build")
+        with bench.scratch_site() as user:
+            apps = [bench.create_app(user) for _ in range(max(1, concurrency))]
+            targets = [apps[i % len(apps)].pk for i in range(deploys)]
+            local = threading.local()
+
+            def post(pk, data):
+                if not hasattr(local, 'client'):
+                    # A client per thread; localhost passes ALLOWED_HOSTS outside the test runner
+                    local.client = APIClient(SERVER_NAME='localhost')
+                    local.client.force_authenticate(user)
+                response = local.client.post(f'/api/apps/{pk}/deploy/', data)
+                if response.status_code != 200:
+                    raise CommandError(f"Deploy failed with {response.status_code}: {response.content[:200]!r}")
+
+            def deploy_zip(pk):
+                post(pk, {'build_file': SimpleUploadedFile('build.zip', archive.getvalue())})
+
+            def deploy_files(pk):
+                post(pk, {'files': [SimpleUploadedFile(path, content) for path, content in build.items()]})
+
+            for mode, deploy in (('build file', deploy_zip), ('files', deploy_files)):
+                # Django refuses more than 100 files per request unless told otherwise
+                with bench.count_queries() as queries, override_settings(DATA_UPLOAD_MAX_NUMBER_FILES=None):
+                    elapsed, latencies = bench.drive_threads(deploy, targets, concurrency)
+                results[mode] = bench.summarize(elapsed, latencies, queries.count)
+                self.report(mode, results[mode], 'deploys/s')
+        return results
+
+    def report(self, mode, summary, unit):
+        self.out.write(
+            f"  {mode:<20}{summary['per_second']:10.1f} {unit}"
+            f"  p50 {summary['p50_ms']:8.2f}ms"
+            f"  p95 {summary['p95_ms']:8.2f}ms"
+            f"  p99 {summary['p99_ms']:8.2f}ms"
+            f"  {summary['queries_per_call']:6.2f} queries"
+            f"  peak RSS {summary['peak_rss_mib']:.0f} MiB"
+        )
+
+    def run_sqlite(self, requests, concurrency, writers, **options):
+        """
+        App lookups (the query behind an uncached resolve_app) from
+        concurrency reader threads while writers threads keep deploying,
+        against a plain SQLite database and one set up like SQLITE_PRODUCTION.
+        """
+        results = {}
+        self.out.write(f"sqlite: {requests} lookups from {concurrency} readers, {writers} writers deploying")
+        for mode, tuned in (('default', False), ('production', True)):
+            alias = f'bench_{mode}'
+            with bench.sqlite_database(alias, tuned) as user:
+                apps = [
+                    App.objects.using(alias).create(
+                        user=user, name=f'bench-{i}', repo_url='https://example.com/bench', subdomain=f'bench-{i}'
+                    )
+                    for i in range(50)
+                ]
+                stats = self._contend(alias, apps, requests, concurrency, writers)
+            reads, writes = stats['reads'], stats['writes']
+            results[mode] = {
+                'reads': bench.summarize(stats['elapsed'], reads),
+                'read_errors': stats['read_errors'],
+                'deploys': bench.summarize(stats['elapsed'], writes),
+                'deploy_errors': stats['write_errors'],
+            }
+            self.out.write(
+                f"  {mode:<12}{len(reads) / stats['elapsed']:8.0f} reads/s"
+                f"  p50 {bench.percentile(reads, 50) * 1000:7.2f}ms"
+                f"  p95 {bench.percentile(reads, 95) * 1000:7.2f}ms"
+                f"  p99 {bench.percentile(reads, 99) * 1000:7.2f}ms"
+                f"  {stats['read_errors']} failed"
+                f"  |  {len(writes) / stats['elapsed']:6.0f} deploys/s"
+                f"  p95 {bench.percentile(writes, 95) * 1000:7.2f}ms"
+                f"  {stats['write_errors']} failed"
+            )
+        return results
+
+    def _contend(self, alias, apps, requests, concurrency, writers):
+        stats = {'reads': [], 'writes': [], 'read_errors': 0, 'write_errors': 0}
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def read(name):
+            try:
+                App.objects.using(alias).filter(name=name).values_list('pk', 'buildnumber', 'cache_index').first()
+            except OperationalError:
+                with lock:
+                    stats['read_errors'] += 1
+            finally:
+                # What the end of a request does: honours CONN_MAX_AGE
+                connections[alias].close_if_unusable_or_obsolete()
+
+        @retry_on_locked(using=alias)
+        def deploy(app):
+            # The writes of a deploy: queue it, claim it, activate the build
+            with transaction.atomic(using=alias):
+                deployment = Deployment.objects.using(alias).create(app=app)
+                Deployment.objects.using(alias).filter(pk=deployment.pk).update(status='running')
+            with transaction.atomic(using=alias):
+                App.objects.using(alias).filter(pk=app.pk).update(buildnumber=time.time_ns(), status='running')
+                Deployment.objects.using(alias).filter(pk=deployment.pk).update(status='succeeded')
+
+        def write(seed):
+            rng = random.Random(seed)
+            try:
+                while not done.is_set():
+                    started = time.perf_counter()
+                    try:
+                        deploy(rng.choice(apps))
+                    except OperationalError:
+                        with lock:
+                            stats['write_errors'] += 1
+                        continue
+                    with lock:
+                        stats['writes'].append(time.perf_counter() - started)
+            finally:
+                connections[alias].close()
+
+        rng = random.Random(0)
+        targets = [rng.choice(apps).name for _ in range(requests)]
+        threads = [threading.Thread(target=write, args=(seed,)) for seed in range(writers)]
+        for thread in threads:
+            thread.start()
+        try:
+            stats['elapsed'], stats['reads'] = bench.drive_threads(read, targets, concurrency)
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+        return stats
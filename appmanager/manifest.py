@@ -0,0 +1,113 @@
+import hashlib
+import json
+import mimetypes
+import os
+from asgiref.sync import sync_to_async
+from pycms.cache import LRUCache
+from .compression import compressed_variants, is_variant
+from .conf import get_setting
+from .preload import index_preload_links
+
+MANIFEST_PREFIX = '.manifest-'
+
+_manifests = LRUCache(maxsize=get_setting('MANIFEST_CACHE_SIZE'))
+
+def manifest_path(build_path, buildnumber):
+    return os.path.join(build_path, f'{MANIFEST_PREFIX}{buildnumber}.json')
+
+def file_digest(path, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def scan_build(build_path, hashes=None):
+    """
+    Walk a build directory and describe every file in it, keyed by its
+    path relative to the build root (always with forward slashes).
+    Precompressed siblings are listed under the file they encode.
+    Content hashes already known from ``hashes`` are not recomputed.
+    """
+    hashes = hashes or {}
+    files = {}
+    for root, dirs, filenames in os.walk(build_path):
+        names = set(filenames)
+        for filename in filenames:
+            if filename.startswith(MANIFEST_PREFIX) or is_variant(filename, names):
+                continue
+            path = os.path.join(root, filename)
+            relpath = os.path.relpath(path, build_path).replace(os.sep, '/')
+            stat = os.stat(path)
+            content_type, _ = mimetypes.guess_type(filename)
+            files[relpath] = {
+                'size': stat.st_size,
+                'mtime': int(stat.st_mtime),
+                'hash': hashes.get(relpath) or file_digest(path),
+                'content_type': content_type,
+                'encodings': {
+                    encoding: os.path.getsize(variant_path)
+                    for encoding, variant_path in compressed_variants(path, names).items()
+                },
+            }
+    return files
+
+def write_manifest(build_path, buildnumber, files=None):
+    """
+    Record the files of build ``buildnumber``, scanning the build unless
+    ``files`` already describes it, along with the preload Link headers for
+    its index.html so they are never worked out per request.
+    """
+    if files is None:
+        files = scan_build(build_path)
+    manifest = {'buildnumber': buildnumber, 'files': files, 'preload': index_preload_links(build_path)}
+    path = manifest_path(build_path, buildnumber)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+    return manifest
+
+def read_manifest(build_path, buildnumber):
+    """
+    Load a build's manifest from disk, or return None if it has none.
+    """
+    try:
+        with open(manifest_path(build_path, buildnumber)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def get_manifest(app):
+    """
+    Return the manifest of the app's active build, loading it at most once
+    per build and worker. Builds deployed before manifests existed are
+    scanned on first use.
+    """
+    key = (app.pk, app.buildnumber)
+    manifest = _manifests.get(key)
+    if manifest is None:
+        manifest = read_manifest(app.build_dir, app.buildnumber)
+        if manifest is None:
+            if not os.path.isdir(app.build_dir):
+                manifest = {'buildnumber': app.buildnumber, 'files': {}, 'preload': []}
+            elif app.buildnumber:
+                manifest = write_manifest(app.build_dir, app.buildnumber)
+            else:
+                manifest = {
+                    'buildnumber': None,
+                    'files': scan_build(app.build_dir),
+                    'preload': index_preload_links(app.build_dir),
+                }
+        _manifests.set(key, manifest)
+    return manifest
+
+async def aget_manifest(app):
+    """
+    get_manifest() for async views; only a manifest not yet in memory is
+    loaded, on a worker thread.
+    """
+    manifest = await _manifests.aget((app.pk, app.buildnumber))
+    if manifest is None:
+        manifest = await sync_to_async(get_manifest)(app)
+    return manifest
@@ -0,0 +1,56 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404
+from .cache import aapp_for_subdomain, app_for_subdomain
+from .conf import get_setting
+from .views import aserve_static_app, serve_static_app
+
+
+class SubdomainAppMiddleware:
+    """
+    Serve <subdomain>.<SUBDOMAIN_BASE_DOMAIN> requests straight from the app
+    registered on that subdomain, without URL resolution. Goes last in
+    MIDDLEWARE, so responses pass back through SecurityMiddleware and
+    XFrameOptionsMiddleware like those of /apps/<name>/. Other hosts pass
+    through untouched.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        base_domain = get_setting('SUBDOMAIN_BASE_DOMAIN')
+        if not base_domain:
+            raise MiddlewareNotUsed
+        self.suffix = '.' + base_domain.lower().strip('.')
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        subdomain = self.subdomain(request)
+        if subdomain is None:
+            return self.get_response(request)
+        return self.serve(request, subdomain)
+
+    async def __acall__(self, request):
+        subdomain = self.subdomain(request)
+        if subdomain is None:
+            return await self.get_response(request)
+        app_name = await aapp_for_subdomain(subdomain)
+        if app_name is None:
+            raise Http404(f"No app is served on '{subdomain}'.")
+        return await aserve_static_app(request, app_name, request.path_info.strip('/') or None)
+
+    def subdomain(self, request):
+        host = request.get_host().lower().rsplit(':', 1)[0]
+        if host.endswith(self.suffix) and len(host) > len(self.suffix):
+            return host[:-len(self.suffix)]
+        return None
+
+    def serve(self, request, subdomain):
+        app_name = app_for_subdomain(subdomain)
+        if app_name is None:
+            raise Http404(f"No app is served on '{subdomain}'.")
+        return serve_static_app(request, app_name, request.path_info.strip('/') or None)
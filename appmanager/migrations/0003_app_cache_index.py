@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmanager', '0002_app_buildnumber'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='app',
+            name='cache_index',
+            field=models.BooleanField(default=True),
+        ),
+    ]
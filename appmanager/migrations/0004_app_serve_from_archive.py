@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmanager', '0003_app_cache_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='app',
+            name='serve_from_archive',
+            field=models.BooleanField(default=False),
+        ),
+    ]
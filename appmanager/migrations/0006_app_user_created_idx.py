@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmanager', '0005_deployment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='app',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='app_user_created_idx'),
+        ),
+    ]
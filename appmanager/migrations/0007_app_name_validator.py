@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:00
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmanager', '0006_app_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='app',
+            name='name',
+            field=models.CharField(max_length=100, unique=True, validators=[django.core.validators.RegexValidator('^[^./\\\\][^/\\\\]*\\Z', 'App names may not start with a dot or contain path separators.')]),
+        ),
+    ]
@@ -1,7 +1,15 @@
+from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models.fields.files import FieldFile
 from users.models import User
 import uuid
 
+# App names become directory names under TEMPLATES_DIR and URL path segments
+validate_app_name = RegexValidator(
+    r'^[^./\\][^/\\]*\Z',
+    'App names may not start with a dot or contain path separators.',
+)
+
 class App(models.Model):
     STATUS_CHOICES = [
         ('deploying', 'Deploying'),
@@ -12,7 +20,7 @@ class App(models.Model):
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='apps')
-    name = models.CharField(max_length=100, unique=True)
+    name = models.CharField(max_length=100, unique=True, validators=[validate_app_name])
     repo_url = models.URLField()
     subdomain = models.CharField(max_length=100, unique=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='deploying')
@@ -21,9 +29,111 @@ class App(models.Model):
     last_deployed = models.DateTimeField(auto_now=True)
     build_file = models.FileField(upload_to='app_builds/', blank=True, null=True)
     buildnumber = models.BigIntegerField(blank=True, null=True)
+    # Render index.html once per build; turn off for templates that need per-request context
+    cache_index = models.BooleanField(default=True)
+    # Serve zip builds straight from the archive instead of extracting them
+    serve_from_archive = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Paginated listing of a user's apps
+            models.Index(fields=['user', 'created_at', 'id'], name='app_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.status})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Snapshot of the row as loaded, so saves can tell what actually changed without a query
+        instance._loaded_values = {
+            field.attname: instance._field_state(field)
+            for field in cls._meta.concrete_fields if field.attname in field_names
+        }
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        # Also how deferred fields are loaded on first access: either way the
+        # fields read from the row become the new baseline for changed_fields()
+        if fields is not None:
+            fields = list(fields)
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        deferred = self.get_deferred_fields()
+        loaded = getattr(self, '_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if fields is None:
+                refreshed = field.attname not in deferred
+            else:
+                refreshed = field.name in fields or field.attname in fields
+            if refreshed:
+                loaded[field.attname] = self._field_state(field)
+        self._loaded_values = loaded
+
+    def save(self, *args, **kwargs):
+        # Worked out before saving: committing a new upload can reuse the old file's name
+        self.dirty_fields = self.changed_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            self.dirty_fields &= {self._meta.get_field(name).attname for name in update_fields}
+        super().save(*args, **kwargs)
+        loaded = getattr(self, '_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if update_fields is None or field.attname in self.dirty_fields:
+                loaded[field.attname] = self._field_state(field)
+        self._loaded_values = loaded
+
+    def loaded_value(self, field_name, default=None):
+        """
+        Value field_name had when the app was loaded or last saved.
+        """
+        return getattr(self, '_loaded_values', {}).get(field_name, default)
+
+    def changed_fields(self):
+        """
+        Attribute names of the fields that differ from the loaded row;
+        every field of an app that was never loaded or saved.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        changed = set()
+        for field in self._meta.concrete_fields:
+            if loaded is None or field.attname not in loaded:
+                if loaded is None or field.attname in self.__dict__:
+                    changed.add(field.attname)
+                continue
+            value = getattr(self, field.attname)
+            if isinstance(value, FieldFile) and not value._committed:
+                changed.add(field.attname)
+            elif self._field_state(field) != loaded[field.attname]:
+                changed.add(field.attname)
+        return changed
+
+    def _field_state(self, field):
+        value = getattr(self, field.attname)
+        if isinstance(value, FieldFile):
+            return value.name or None
+        return value
+
+
+class Deployment(models.Model):
+    # One requested deploy of an app; queued deploys are superseded by newer ones
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('superseded', 'Superseded'),
+    ]
+
+    app = models.ForeignKey(App, on_delete=models.CASCADE, related_name='deployments')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    buildnumber = models.BigIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"{self.app.name} #{self.pk} ({self.status})"
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+from .conf import get_setting
+
+class AppCursorPagination(CursorPagination):
+    """
+    Keyset pagination of a user's apps, newest first. Each page continues
+    from the last (created_at, id) seen, so it is one range scan of the
+    (user, created_at, id) index however far the client has paged.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = get_setting('APP_PAGE_SIZE')
+    page_size_query_param = 'page_size'
+    max_page_size = get_setting('APP_MAX_PAGE_SIZE')
@@ -0,0 +1,35 @@
+import os
+import posixpath
+from django.conf import settings
+
+# Each build lives in <TEMPLATES_DIR>/<app>/builds/<buildnumber>/
+BUILDS_DIRNAME = 'builds'
+
+def app_dir(app_name):
+    return os.path.join(settings.TEMPLATES_DIR, app_name)
+
+def builds_dir(app_name):
+    return os.path.join(app_dir(app_name), BUILDS_DIRNAME)
+
+def build_dir(app_name, buildnumber):
+    return os.path.join(builds_dir(app_name), str(buildnumber))
+
+def list_builds(app_name):
+    """
+    Return the buildnumbers extracted on disk for app_name, oldest first.
+    """
+    try:
+        names = os.listdir(builds_dir(app_name))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+def safe_relpath(path):
+    """
+    Normalise a client- or archive-supplied build path, rejecting anything
+    that could escape the build directory.
+    """
+    normalized = posixpath.normpath(path.replace('\\', '/'))
+    if not path or normalized.startswith(('/', '../')) or normalized in ('.', '..') or ':' in normalized:
+        raise ValueError(f"Invalid build path '{path}'")
+    return normalized
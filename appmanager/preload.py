@@ -0,0 +1,85 @@
+import os
+from html.parser import HTMLParser
+from urllib.parse import quote, urljoin, urlsplit
+from .conf import get_setting
+
+FONT_EXTENSIONS = {'.woff2', '.woff', '.ttf', '.otf'}
+
+# Characters left as they are when an href is written into a Link header
+URL_SAFE = "/:?#[]@!$&'()*+,;=%~"
+
+class PreloadParser(HTMLParser):
+    """
+    Collect the render-critical subresources an index.html references:
+    blocking and module scripts, stylesheets and links the page already
+    marks as preload/modulepreload. Each hint is a (href, rel, as, crossorigin)
+    tuple, in document order and without duplicates.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.base = None
+        self.hints = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {name: value or '' for name, value in attrs}
+        if tag == 'base' and attrs.get('href') and self.base is None:
+            self.base = attrs['href']
+        elif tag == 'script' and attrs.get('src'):
+            rel = 'modulepreload' if attrs.get('type') == 'module' else 'preload'
+            self.add(attrs['src'], rel, 'script', attrs.get('crossorigin'))
+        elif tag == 'link' and attrs.get('href'):
+            rels = set(attrs.get('rel', '').lower().split())
+            if 'stylesheet' in rels:
+                self.add(attrs['href'], 'preload', 'style', attrs.get('crossorigin'))
+            elif 'modulepreload' in rels:
+                self.add(attrs['href'], 'modulepreload', 'script', attrs.get('crossorigin'))
+            elif 'preload' in rels and attrs.get('as'):
+                crossorigin = attrs.get('crossorigin')
+                # Fonts are always fetched in CORS mode, so the hint must be too
+                if attrs['as'] == 'font' and crossorigin is None:
+                    crossorigin = 'anonymous'
+                self.add(attrs['href'], 'preload', attrs['as'], crossorigin)
+
+    def add(self, href, rel, as_, crossorigin):
+        if self.base:
+            href = urljoin(self.base, href)
+        parts = urlsplit(href)
+        # Only the page's own files; Link on a response is not the place to
+        # warm up third-party origins
+        if parts.scheme or parts.netloc:
+            return
+        if any(hint[0] == href for hint in self.hints):
+            return
+        if as_ == 'font' and os.path.splitext(parts.path)[1].lower() not in FONT_EXTENSIONS:
+            return
+        self.hints.append((href, rel, as_, crossorigin))
+
+def preload_links(html):
+    """
+    Return the Link header values preloading what index.html needs for its
+    first render, at most PRELOAD_MAX_HINTS of them.
+    """
+    limit = get_setting('PRELOAD_MAX_HINTS')
+    if not limit:
+        return []
+    parser = PreloadParser()
+    parser.feed(html)
+    parser.close()
+    links = []
+    for href, rel, as_, crossorigin in parser.hints[:limit]:
+        link = f"<{quote(href, safe=URL_SAFE)}>; rel={rel}; as={as_}"
+        if crossorigin is not None:
+            link += '; crossorigin' if crossorigin in ('', 'anonymous') else f'; crossorigin={crossorigin}'
+        links.append(link)
+    return links
+
+def index_preload_links(build_path):
+    """
+    preload_links() of the build's index.html, or [] if it has none.
+    """
+    try:
+        with open(os.path.join(build_path, 'index.html'), encoding='utf-8', errors='replace') as f:
+            return preload_links(f.read())
+    except OSError:
+        return []
@@ -1,8 +1,24 @@
 from rest_framework import serializers
-from .models import App
+from .models import App, Deployment
 
 class AppSerializer(serializers.ModelSerializer):
+    """
+    Pass fields to serialize only some of the app's fields.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     class Meta:
         model = App
-        fields = ('id', 'name', 'repo_url', 'subdomain', 'status', 'created_at', 'updated_at', 'buildnumber', 'build_file')
-        read_only_fields = ('id', 'created_at', 'updated_at', 'buildnumber')
\ No newline at end of file
+        fields = ('id', 'name', 'repo_url', 'subdomain', 'status', 'created_at', 'updated_at', 'buildnumber', 'build_file', 'cache_index', 'serve_from_archive')
+        read_only_fields = ('id', 'created_at', 'updated_at', 'buildnumber')
+
+class DeploymentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Deployment
+        fields = ('id', 'status', 'buildnumber', 'created_at', 'finished_at')
+        read_only_fields = fields
@@ -1,72 +1,68 @@
+import contextlib
 import os
-import zipfile
-import time
-import shutil
-import glob
+import threading
 from django.db.models.signals import post_save, post_delete, pre_save
+from django.db import transaction
 from django.dispatch import receiver
-from django.conf import settings
+from .blobs import collect_garbage
+from .builds import remove_app_files, schedule_deploy
+from .cache import invalidate_app, invalidate_subdomains
 from .models import App
 
+# Apps deleted inside deferred_removal(), per thread
+_deferred = threading.local()
+
 @receiver(pre_save, sender=App)
-def remove_old_zip_and_templates_on_update(sender, instance, **kwargs):
-    if not instance.pk:
-        return  # New object, nothing to do
-    try:
-        old_instance = App.objects.get(pk=instance.pk)
-    except App.DoesNotExist:
-        return
-    old_file = old_instance.build_file
-    new_file = instance.build_file
-    templates_dir = os.path.join(settings.TEMPLATES_DIR, instance.name)
+def remove_old_zip_on_update(sender, instance, **kwargs):
+    # App.save() compares against the loaded row, so no query is needed here
+    changed = getattr(instance, 'dirty_fields', set())
+    old_name = instance.loaded_value('name')
+    if 'name' in changed and old_name:
+        # Renamed apps must stop resolving under their old name
+        transaction.on_commit(lambda: invalidate_app(old_name))
+    old_file = instance.loaded_value('build_file')
     # Remove old zip if changed
-    if old_file and old_file != new_file and os.path.exists(old_file.path):
+    if 'build_file' in changed and old_file:
         try:
-            os.remove(old_file.path)
+            os.remove(instance.build_file.storage.path(old_file))
         except Exception:
             pass
-    # Remove all index_* templates (versioned and plain) before new upload
-    if os.path.exists(templates_dir):
-        patterns = ["index.html", "index_*.html"]
-        for pattern in patterns:
-            for f in glob.glob(os.path.join(templates_dir, pattern)):
-                try:
-                    os.remove(f)
-                except Exception:
-                    pass
 
 @receiver(post_save, sender=App)
 def handle_build_artifact(sender, instance, created, **kwargs):
-    if instance.build_file:
-        # Set buildnumber to current timestamp
-        buildnumber = int(time.time())
-        App.objects.filter(pk=instance.pk).update(buildnumber=buildnumber)
-        instance.buildnumber = buildnumber  # update in-memory instance
+    # Only a newly uploaded build_file is deployed; saves of other fields leave the build alone
+    if instance.build_file and 'build_file' in getattr(instance, 'dirty_fields', set()):
+        schedule_deploy(instance)
 
-        templates_dir = os.path.join(settings.TEMPLATES_DIR, instance.name)
-        os.makedirs(templates_dir, exist_ok=True)
-        build_path = instance.build_file.path
-        with zipfile.ZipFile(build_path, 'r') as zip_ref:
-            zip_ref.extractall(templates_dir)  # Extract everything to templates_dir
+@receiver(post_save, sender=App)
+@receiver(post_delete, sender=App)
+def invalidate_app_cache(sender, instance, **kwargs):
+    # Wait for the commit so other workers reload the saved row, not the old one
+    transaction.on_commit(lambda: invalidate_app(instance.name))
+    if kwargs.get('signal') is post_delete or {'name', 'subdomain'} & getattr(instance, 'dirty_fields', set()):
+        transaction.on_commit(invalidate_subdomains)
 
-        index_html_path = os.path.join(templates_dir, 'index.html')
-        versioned_template = os.path.join(templates_dir, f'index_{buildnumber}.html')
-        if os.path.exists(index_html_path):
-            # Copy index.html to versioned index.html in templates
-            shutil.copy2(index_html_path, versioned_template)
+@contextlib.contextmanager
+def deferred_removal():
+    """
+    Collect (app name, build file path) for the apps deleted on this thread
+    inside the block instead of removing their files one by one, so a bulk
+    delete can remove them all in parallel and collect blobs once.
+    """
+    _deferred.removals = []
+    try:
+        yield _deferred.removals
+    finally:
+        del _deferred.removals
 
 @receiver(post_delete, sender=App)
 def remove_build_artifact(sender, instance, **kwargs):
-    templates_dir = os.path.join(settings.TEMPLATES_DIR, instance.name)
-    # Remove the entire templates directory for the app (including all static and template files)
-    if os.path.exists(templates_dir):
-        try:
-            shutil.rmtree(templates_dir)
-        except Exception:
-            pass
-    # Remove the uploaded zip file if it exists
-    if instance.build_file and os.path.exists(instance.build_file.path):
-        try:
-            os.remove(instance.build_file.path)
-        except Exception:
-            pass
+    build_file_path = instance.build_file.path if instance.build_file else None
+    removals = getattr(_deferred, 'removals', None)
+    if removals is not None:
+        removals.append((instance.name, build_file_path))
+        return
+    # Remove the entire templates directory for the app (including all builds) and the uploaded zip
+    garbage = remove_app_files(instance.name, build_file_path)
+    if garbage:
+        collect_garbage(garbage)
@@ -0,0 +1,62 @@
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections, connections
+from .conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_setting('DEPLOY_WORKERS'),
+                thread_name_prefix='appmanager-deploy',
+            )
+        return _executor
+
+def enqueue(func, *args):
+    """
+    Run func(*args) on the deploy worker pool, or inline when DEPLOY_ASYNC is off.
+    Returns True if the work was queued.
+    """
+    if not get_setting('DEPLOY_ASYNC'):
+        func(*args)
+        return False
+    _get_executor().submit(_run, func, *args)
+    return True
+
+def map_parallel(func, items):
+    """
+    Return [func(item) for item in items], computed on a short-lived pool of
+    BULK_WORKERS threads. Meant for work a request waits on, which should not
+    queue behind deploys on the deploy pool.
+    """
+    items = list(items)
+    workers = min(get_setting('BULK_WORKERS'), len(items))
+    if workers < 2:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='appmanager-bulk') as pool:
+        return list(pool.map(functools.partial(_call_in_pool, func), items))
+
+def _call_in_pool(func, item):
+    # Pool threads end with the batch; don't leave their database connections behind
+    try:
+        return func(item)
+    finally:
+        connections.close_all()
+
+def _run(func, *args):
+    # Worker threads get their own database connections; don't leak them between tasks
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Deploy task %s failed", func.__name__)
+    finally:
+        close_old_connections()
@@ -1,3 +1,1072 @@
-from django.test import TestCase
+import contextlib
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.utils.http import http_date
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from pycms.db import configure_sqlite, retry_on_locked
+from users.models import User
+from . import views
+from . import bench, blobs, tasks, uploads
+from .archives import ArchiveError, MemberReader, extract_archive, link_archive
+from .builds import activate_build, deploy_lock, reclaim_stale_deployments
+from .cache import invalidate_app, resolve_app
+from .middleware import SubdomainAppMiddleware
+from .paths import build_dir, list_builds
+from .preload import preload_links
+from .serializers import AppSerializer
+from .models import App, Deployment
 
-# Create your tests here.
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return buffer.getvalue()
+
+
+def make_tar(files, mode='w:gz'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as tf:
+        for name, content in files.items():
+            data = content.encode() if isinstance(content, str) else content
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class ScratchSiteMixin:
+    """
+    Point the template and media roots at throwaway directories.
+    """
+    app_manager = {'DEPLOY_ASYNC': False}
+
+    def setUp(self):
+        self.templates_dir = tempfile.mkdtemp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.templates_dir, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.templates_dir + '-blobs', ignore_errors=True)
+        overrides = override_settings(
+            TEMPLATES_DIR=self.templates_dir,
+            MEDIA_ROOT=self.media_root,
+            APP_MANAGER=self.app_manager,
+            TEMPLATES=[{
+                'BACKEND': 'django.template.backends.django.DjangoTemplates',
+                'DIRS': [self.templates_dir],
+                'OPTIONS': {'context_processors': ['django.template.context_processors.request']},
+            }],
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        invalidate_app()
+        self.addCleanup(invalidate_app)
+        self.user = User.objects.create_user(username='owner', password='secret')
+
+    def create_app(self, name='demo', **kwargs):
+        return App.objects.create(
+            user=self.user, name=name, repo_url='https://example.com/repo', subdomain=name, **kwargs
+        )
+
+    @contextlib.contextmanager
+    def track_build_access(self, app_name='demo'):
+        """
+        Collect every open()/stat() of a path inside an app's build directory.
+        """
+        app_dir = os.path.join(self.templates_dir, app_name)
+        touched = []
+        real_open, real_stat = open, os.stat
+
+        def tracking(real):
+            def wrapper(path, *args, **kwargs):
+                if str(path).startswith(app_dir):
+                    touched.append(path)
+                return real(path, *args, **kwargs)
+            return wrapper
+
+        with mock.patch('builtins.open', tracking(real_open)), mock.patch('os.stat', tracking(real_stat)):
+            yield touched
+
+    def deploy(self, app, files):
+        app.build_file = SimpleUploadedFile('build.zip', make_zip(files))
+        with self.captureOnCommitCallbacks(execute=True):
+            app.save()
+        app.refresh_from_db()
+        return app
+
+
+# Keeps the suite's invalidation stamps out of the site's shared cache
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AppManagerTestCase(ScratchSiteMixin, TestCase):
+    """
+    Base class pointing the template and media roots at throwaway directories.
+    Bulk work runs inline: other threads cannot see the test's transaction.
+    """
+    app_manager = {'DEPLOY_ASYNC': False, 'BULK_WORKERS': 1}
+
+
+class ResolveAppTests(AppManagerTestCase):
+
+    def test_lookups_are_cached(self):
+        self.create_app(buildnumber=42)
+        with self.assertNumQueries(1):
+            resolve_app('demo')
+            entry = resolve_app('demo')
+        self.assertEqual(entry.buildnumber, 42)
+
+    def test_missing_apps_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(resolve_app('nope'))
+            self.assertIsNone(resolve_app('nope'))
+
+    def test_save_and_delete_invalidate(self):
+        self.assertIsNone(resolve_app('demo'))
+        with self.captureOnCommitCallbacks(execute=True):
+            app = self.create_app(buildnumber=1)
+        self.assertEqual(resolve_app('demo').buildnumber, 1)
+        app.buildnumber = 2
+        with self.captureOnCommitCallbacks(execute=True):
+            app.save()
+        self.assertEqual(resolve_app('demo').buildnumber, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            app.delete()
+        self.assertIsNone(resolve_app('demo'))
+
+
+BUILD = {
+    'index.html': '<html><body>demo</body></html>',
+    'static/js/main.1a2b3c4d.js': 'console.log("hi");',
+    'manifest.json': '{}',
+}
+
+
+class ServeStaticAppTests(AppManagerTestCase):
+
+    def test_serves_index_and_assets(self):
+        self.deploy(self.create_app(), BUILD)
+        response = self.client.get('/apps/demo/')
+        self.assertContains(response, 'demo')
+        response = self.client.get('/apps/demo/static/js/main.1a2b3c4d.js')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'console.log("hi");')
+        self.assertEqual(response['Content-Type'], 'text/javascript')
+
+    def test_unknown_assets_404_without_touching_disk(self):
+        self.deploy(self.create_app(), BUILD)
+        self.client.get('/apps/demo/manifest.json')
+        with self.track_build_access() as touched:
+            response = self.client.get('/apps/demo/static/js/missing.js')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(touched, [])
+
+    def test_client_side_routes_serve_index(self):
+        self.deploy(self.create_app(), BUILD)
+        self.assertContains(self.client.get('/apps/demo/settings/profile'), 'demo')
+
+    def test_assets_carry_validators_and_answer_304(self):
+        self.deploy(self.create_app(), BUILD)
+        response = self.client.get('/apps/demo/static/js/main.1a2b3c4d.js')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+        with self.track_build_access() as touched:
+            response = self.client.get(
+                '/apps/demo/static/js/main.1a2b3c4d.js', HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(touched, [])
+        response = self.client.get('/apps/demo/manifest.json')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+    def test_index_is_validated_by_buildnumber(self):
+        app = self.deploy(self.create_app(), BUILD)
+        response = self.client.get('/apps/demo/')
+        self.assertEqual(response['ETag'], f'"demo-{app.buildnumber}"')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        response = self.client.get('/apps/demo/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_precompressed_variants_are_negotiated(self):
+        bundle = 'console.log("hello world");\n' * 200
+        self.deploy(self.create_app(), dict(BUILD, **{'static/js/app.0f0f0f0f.js': bundle}))
+        response = self.client.get('/apps/demo/static/js/app.0f0f0f0f.js', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode(), bundle)
+        response = self.client.get('/apps/demo/static/js/app.0f0f0f0f.js', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(b''.join(response.streaming_content).decode(), bundle)
+        # Small files are not worth compressing
+        response = self.client.get('/apps/demo/static/js/main.1a2b3c4d.js', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_single_byte_ranges(self):
+        self.deploy(self.create_app(), BUILD)
+        url, content = '/apps/demo/static/js/main.1a2b3c4d.js', BUILD['static/js/main.1a2b3c4d.js'].encode()
+        self.assertEqual(self.client.get(url)['Accept-Ranges'], 'bytes')
+        for header, expected in (('bytes=2-5', (2, 5)), ('bytes=4-', (4, len(content) - 1)),
+                                 ('bytes=-3', (len(content) - 3, len(content) - 1)), ('bytes=2-9999', (2, len(content) - 1))):
+            response = self.client.get(url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], f'bytes {expected[0]}-{expected[1]}/{len(content)}')
+            self.assertEqual(b''.join(response.streaming_content), content[expected[0]:expected[1] + 1])
+        response = self.client.get(url, HTTP_RANGE='bytes=9999-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(content)}')
+        for extra in ({'HTTP_RANGE': 'bytes=0-1,4-5'}, {'HTTP_RANGE': 'bytes=2-5', 'HTTP_IF_RANGE': '"stale"'}):
+            response = self.client.get(url, **extra)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), content)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE=etag).status_code, 206)
+
+    def test_media_and_other_build_files_are_served_with_ranges(self):
+        video, wasm = bytes(range(256)) * 4, b'\0asm\1\0\0\0'
+        self.deploy(self.create_app(), dict(BUILD, **{'static/media/intro.mp4': video, 'app.wasm': wasm}))
+        response = self.client.get('/apps/demo/static/media/intro.mp4', HTTP_RANGE='bytes=0-99')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Content-Range'], f'bytes 0-99/{len(video)}')
+        self.assertEqual(b''.join(response.streaming_content), video[:100])
+        self.assertEqual(b''.join(self.client.get('/apps/demo/app.wasm').streaming_content), wasm)
+        self.assertEqual(self.client.get('/apps/demo/static/media/missing.webm').status_code, 404)
+        # HTML pages of the build are still rendered as the index
+        self.assertContains(self.client.get('/apps/demo/index.html'), 'demo')
+
+    def test_ranges_of_archive_members(self):
+        bundle = ' '.join(str(i * 7919) for i in range(60000)).encode()
+        self.deploy(self.create_app(serve_from_archive=True), dict(BUILD, **{'static/js/big.js': bundle}))
+        with mock.patch.object(MemberReader, 'STREAM_THRESHOLD', 0):
+            response = self.client.get('/apps/demo/static/js/big.js', HTTP_RANGE='bytes=300000-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), bundle[300000:])
+
+    def test_sendfile_offload(self):
+        app = self.deploy(self.create_app(), BUILD)
+        url = '/apps/demo/static/js/main.1a2b3c4d.js'
+        with override_settings(APP_MANAGER={'SENDFILE_BACKEND': 'nginx', 'SENDFILE_URL_PREFIX': '/_webapps/'}):
+            response = self.client.get(url)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f'/_webapps/demo/builds/{app.buildnumber}/static/js/main.1a2b3c4d.js')
+        self.assertEqual(response['Content-Type'], 'text/javascript')
+        self.assertIn('ETag', response)
+        with override_settings(APP_MANAGER={'SENDFILE_BACKEND': 'apache'}):
+            response = self.client.get(url, HTTP_RANGE='bytes=0-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], os.path.join(build_dir('demo', app.buildnumber), 'static/js/main.1a2b3c4d.js'))
+
+    def test_index_is_rendered_once_per_build(self):
+        app = self.deploy(self.create_app(), BUILD)
+        with mock.patch('appmanager.views.render_to_string', wraps=views.render_to_string) as rendered:
+            self.client.get('/apps/demo/')
+            self.client.get('/apps/demo/about')
+            self.assertEqual(rendered.call_count, 1)
+            self.deploy(app, dict(BUILD, **{'index.html': '<html>v2</html>'}))
+            self.assertContains(self.client.get('/apps/demo/'), 'v2')
+            self.assertEqual(rendered.call_count, 2)
+
+    def test_preload_links_from_index(self):
+        html = """<!doctype html><html><head>
+            <link rel="preconnect" href="https://fonts.example.com">
+            <link rel="stylesheet" href="/apps/demo/static/css/main.css">
+            <link rel="stylesheet" href="https://cdn.example.com/lib.css">
+            <link rel="preload" href="/apps/demo/static/media/inter.woff2" as="font" type="font/woff2">
+            <link rel="icon" href="/apps/demo/favicon.ico">
+            <script type="module" src="/apps/demo/static/js/entry.js"></script>
+            <script defer src="/apps/demo/static/js/main.js"></script>
+            <script src="/apps/demo/static/js/main.js"></script>
+            <script>inline()</script>
+        </head></html>"""
+        self.assertEqual(preload_links(html), [
+            '</apps/demo/static/css/main.css>; rel=preload; as=style',
+            '</apps/demo/static/media/inter.woff2>; rel=preload; as=font; crossorigin',
+            '</apps/demo/static/js/entry.js>; rel=modulepreload; as=script',
+            '</apps/demo/static/js/main.js>; rel=preload; as=script',
+        ])
+        self.assertEqual(preload_links('<base href="/apps/demo/"><script src="static/js/a b.js"></script>'),
+                         ['</apps/demo/static/js/a%20b.js>; rel=preload; as=script'])
+        with override_settings(APP_MANAGER={'PRELOAD_MAX_HINTS': 1}):
+            self.assertEqual(len(preload_links(html)), 1)
+
+    def test_index_announces_preloads(self):
+        index = ('<html><head><link rel="stylesheet" href="/apps/demo/static/css/main.css"></head>'
+                 '<body><script src="/apps/demo/static/js/main.1a2b3c4d.js"></script></body></html>')
+        expected = ('</apps/demo/static/css/main.css>; rel=preload; as=style, '
+                    '</apps/demo/static/js/main.1a2b3c4d.js>; rel=preload; as=script')
+        app = self.deploy(self.create_app(), dict(BUILD, **{'index.html': index}))
+        with mock.patch('appmanager.preload.PreloadParser.feed') as parsed:
+            self.assertEqual(self.client.get('/apps/demo/')['Link'], expected)
+            self.assertEqual(self.client.get('/apps/demo/about')['Link'], expected)
+            parsed.assert_not_called()
+        self.assertNotIn('Link', self.client.get('/apps/demo/static/js/main.1a2b3c4d.js'))
+        app.serve_from_archive = True
+        self.deploy(app, dict(BUILD, **{'index.html': index}))
+        self.assertEqual(self.client.get('/apps/demo/')['Link'], expected)
+        self.deploy(app, BUILD)
+        self.assertNotIn('Link', self.client.get('/apps/demo/'))
+
+    def test_preloaded_fonts_are_served(self):
+        index = ('<html><head><link rel="preload" href="/apps/demo/static/media/inter.3f2a9c1b.woff2" as="font">'
+                 '</head></html>')
+        font = b'wOF2' + bytes(64)
+        self.deploy(self.create_app(), dict(BUILD, **{'index.html': index, 'static/media/inter.3f2a9c1b.woff2': font}))
+        link = self.client.get('/apps/demo/')['Link']
+        self.assertEqual(link, '</apps/demo/static/media/inter.3f2a9c1b.woff2>; rel=preload; as=font; crossorigin')
+        response = self.client.get(link[1:link.index('>')])
+        self.assertEqual(response['Content-Type'], 'font/woff2')
+        self.assertEqual(b''.join(response.streaming_content), font)
+
+    def test_index_cache_opt_out_renders_with_request_context(self):
+        self.deploy(self.create_app(cache_index=False), {'index.html': '{{ request.path }}'})
+        self.assertContains(self.client.get('/apps/demo/one'), '/apps/demo/one')
+        self.assertContains(self.client.get('/apps/demo/two'), '/apps/demo/two')
+
+
+@override_settings(ALLOWED_HOSTS=['.apps.test', 'testserver'])
+class SubdomainRoutingTests(AppManagerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        overrides = override_settings(APP_MANAGER={'DEPLOY_ASYNC': False, 'SUBDOMAIN_BASE_DOMAIN': 'apps.test'})
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.app = self.deploy(self.create_app(), BUILD)
+
+    def test_app_is_served_on_its_subdomain_without_url_resolution(self):
+        with mock.patch('django.urls.resolvers.URLResolver.resolve') as resolve:
+            self.assertContains(self.client.get('/', HTTP_HOST='demo.apps.test'), 'demo')
+            self.assertContains(self.client.get('/some/route/', HTTP_HOST='Demo.apps.test:8000'), 'demo')
+            response = self.client.get('/static/js/main.1a2b3c4d.js', HTTP_HOST='demo.apps.test')
+            self.assertEqual(b''.join(response.streaming_content), BUILD['static/js/main.1a2b3c4d.js'].encode())
+            self.assertEqual(self.client.get('/', HTTP_HOST='missing.apps.test').status_code, 404)
+        resolve.assert_not_called()
+        self.assertContains(self.client.get('/apps/demo/'), 'demo')
+
+    @override_settings(SECURE_HSTS_SECONDS=3600)
+    def test_subdomain_responses_carry_the_security_headers(self):
+        headers = ('X-Frame-Options', 'X-Content-Type-Options', 'Referrer-Policy', 'Cross-Origin-Opener-Policy',
+                   'Strict-Transport-Security')
+        for path in ('/', '/static/js/main.1a2b3c4d.js'):
+            on_subdomain = self.client.get(path, HTTP_HOST='demo.apps.test', secure=True)
+            on_path = self.client.get(f'/apps/demo{path}', secure=True)
+            for header in headers:
+                self.assertIn(header, on_subdomain)
+                self.assertEqual(on_subdomain[header], on_path[header])
+
+    def test_subdomain_table_follows_app_changes(self):
+        self.client.get('/', HTTP_HOST='demo.apps.test')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.app.subdomain = 'renamed'
+            self.app.save()
+        self.assertEqual(self.client.get('/', HTTP_HOST='demo.apps.test').status_code, 404)
+        self.assertContains(self.client.get('/', HTTP_HOST='renamed.apps.test'), 'demo')
+        with self.assertNumQueries(0):
+            self.client.get('/', HTTP_HOST='renamed.apps.test')
+
+    async def test_async_requests_are_served(self):
+        async def get_response(request):
+            return HttpResponse('passed through')
+
+        middleware = SubdomainAppMiddleware(get_response)
+        request = AsyncRequestFactory().get('/')
+        request.META['HTTP_HOST'] = 'demo.apps.test'
+        self.assertContains(await middleware(request), 'demo')
+        request.META['HTTP_HOST'] = 'testserver'
+        self.assertContains(await middleware(request), 'passed through')
+
+
+class AsyncServingTests(AppManagerTestCase):
+
+    async def aget(self, subpath=None, **headers):
+        request = AsyncRequestFactory().get(f'/apps/demo/{subpath or ""}', headers=headers)
+        response = await views.aserve_static_app(request, 'demo', subpath)
+        if response.streaming:
+            return response, b''.join([chunk async for chunk in response.streaming_content])
+        return response, response.content
+
+    def deploy_large(self, **kwargs):
+        files = dict(BUILD, **{'static/js/big.js': ' '.join(str(i * 7919) for i in range(60000))})
+        self.deploy(self.create_app(**kwargs), files)
+        return files['static/js/big.js'].encode()
+
+    async def test_assets_are_streamed(self):
+        big = await sync_to_async(self.deploy_large)()
+        response, content = await self.aget('static/js/big.js')
+        self.assertGreater(len(big), views.STREAM_CHUNK_SIZE)
+        self.assertEqual(content, big)
+        self.assertEqual(int(response['Content-Length']), len(big))
+        response, content = await self.aget('static/js/main.1a2b3c4d.js', accept_encoding='gzip')
+        self.assertEqual(content, BUILD['static/js/main.1a2b3c4d.js'].encode())
+        etag = (await self.aget('static/js/big.js'))[0]['ETag']
+        self.assertEqual((await self.aget('static/js/big.js', if_none_match=etag))[0].status_code, 304)
+
+    async def test_archive_backed_assets_are_streamed(self):
+        big = await sync_to_async(self.deploy_large)(serve_from_archive=True)
+        self.assertEqual((await self.aget('static/js/big.js'))[1], big)
+        response, content = await self.aget('static/js/big.js', range='bytes=1000-299999')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, big[1000:300000])
+
+    async def test_index_is_served(self):
+        await sync_to_async(self.deploy_large)()
+        response, content = await self.aget()
+        self.assertIn(b'demo', content)
+        self.assertEqual((await self.aget(if_none_match=response['ETag']))[0].status_code, 304)
+        with self.assertRaises(Http404):
+            await views.aserve_static_app(AsyncRequestFactory().get('/apps/missing/'), 'missing')
+
+
+class BuildActivationTests(AppManagerTestCase):
+
+    def test_each_deploy_gets_its_own_build_directory(self):
+        app = self.deploy(self.create_app(), BUILD)
+        first = app.buildnumber
+        app = self.deploy(app, dict(BUILD, **{'index.html': '<html>v2</html>'}))
+        self.assertEqual(list_builds('demo'), [first, app.buildnumber])
+        with open(os.path.join(build_dir('demo', first), 'index.html')) as f:
+            self.assertIn('demo', f.read())
+        self.assertContains(self.client.get('/apps/demo/'), 'v2')
+
+    @override_settings(APP_MANAGER={'DEPLOY_ASYNC': False, 'BUILD_RETENTION': 2})
+    def test_old_builds_are_pruned(self):
+        app = self.create_app()
+        with mock.patch('appmanager.builds.collect_garbage', wraps=blobs.collect_garbage) as collected:
+            for _ in range(4):
+                app = self.deploy(app, BUILD)
+        # Only the blobs of the pruned builds are checked, never the whole store
+        self.assertTrue(collected.call_args_list)
+        self.assertTrue(all(call.args[0] for call in collected.call_args_list))
+        self.assertEqual(len(list_builds('demo')), 2)
+        self.assertEqual(list_builds('demo')[-1], app.buildnumber)
+
+    def test_pruning_errors_do_not_fail_a_live_deploy(self):
+        with mock.patch('appmanager.builds.prune_builds', side_effect=OSError('disk full')), \
+                self.assertLogs('appmanager.builds', 'ERROR'):
+            app = self.deploy(self.create_app(), BUILD)
+        self.assertEqual(app.status, 'running')
+        self.assertEqual(app.deployments.get().status, 'succeeded')
+        self.assertContains(self.client.get('/apps/demo/'), 'demo')
+
+    def test_flat_layout_from_before_versioned_builds_is_served(self):
+        legacy_dir = os.path.join(self.templates_dir, 'demo')
+        os.makedirs(os.path.join(legacy_dir, 'static'))
+        for name, content in (('index_7.html', 'legacy'), ('static/app.css', 'body {}')):
+            with open(os.path.join(legacy_dir, name), 'w') as f:
+                f.write(content)
+        self.create_app(buildnumber=7)
+        self.assertContains(self.client.get('/apps/demo/'), 'legacy')
+        self.assertEqual(self.client.get('/apps/demo/static/app.css').status_code, 200)
+
+
+class ArchiveTests(AppManagerTestCase):
+
+    def extract(self, data, **kwargs):
+        archive = os.path.join(self.media_root, 'build')
+        with open(archive, 'wb') as f:
+            f.write(data)
+        dest = tempfile.mkdtemp(dir=self.media_root)
+        extract_archive(archive, dest, **kwargs)
+        return dest
+
+    def test_tar_gz_build_is_deployed(self):
+        app = self.create_app()
+        app.build_file = SimpleUploadedFile('build.tar.gz', make_tar(BUILD))
+        with self.captureOnCommitCallbacks(execute=True):
+            app.save()
+        self.assertContains(self.client.get('/apps/demo/'), 'demo')
+
+    def test_plain_tar_and_zip_are_extracted(self):
+        for data in (make_tar(BUILD, 'w'), make_zip(BUILD)):
+            dest = self.extract(data)
+            with open(os.path.join(dest, 'static', 'js', 'main.1a2b3c4d.js')) as f:
+                self.assertEqual(f.read(), BUILD['static/js/main.1a2b3c4d.js'])
+
+    def test_unsafe_and_unknown_archives_are_rejected(self):
+        for data in (make_tar({'../escape.txt': 'x'}), make_zip({'/etc/escape': 'x'}), b'neither'):
+            with self.assertRaises(ArchiveError):
+                self.extract(data)
+
+    @override_settings(APP_MANAGER={'EXTRACT_PARALLEL_MIN_FILES': 1})
+    def test_parallel_extraction(self):
+        build = bench.synthetic_build(files=40, size=512)
+        for pool in ('thread', 'process'):
+            dest = self.extract(make_zip(build), workers=3, pool=pool)
+            for name, content in build.items():
+                with open(os.path.join(dest, name), 'rb') as f:
+                    self.assertEqual(f.read(), content)
+
+    def test_extract_benchmark(self):
+        out = io.StringIO()
+        call_command('benchmark', 'extract', '--files', '20', '--workers', '2', '--repeat', '1', stdout=out)
+        self.assertIn('zipfile.extractall', out.getvalue())
+        self.assertIn('thread workers=2', out.getvalue())
+
+    def test_benchmark_json_report(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('benchmark', 'extract', '--files', '20', '--workers', '2', '--repeat', '1', '--json', '-',
+                     stdout=out, stderr=err)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['parameters']['workers'], [2])
+        self.assertIn('commit', report['run'])
+        self.assertEqual(set(report['results']['thread workers=2']), {'median_s', 'speedup', 'phases'})
+        self.assertIn('zipfile.extractall', err.getvalue())
+        summary = bench.summarize(2.0, [0.01] * 98 + [0.5, 1.0], queries=300)
+        self.assertEqual((summary['per_second'], summary['p50_ms'], summary['p99_ms']), (50.0, 10.0, 500.0))
+        self.assertEqual(summary['queries_per_call'], 3.0)
+        self.assertGreater(summary['peak_rss_mib'], 0)
+
+    def test_archive_backed_build_is_served_without_extraction(self):
+        files = dict(BUILD, **{'static/js/big.js': ' '.join(str(i * 7919) for i in range(60000))})
+        app = self.deploy(self.create_app(serve_from_archive=True), files)
+        path = build_dir('demo', app.buildnumber)
+        self.assertEqual(sorted(os.listdir(path)), ['.build.zip', f'.manifest-{app.buildnumber}.json', 'index.html'])
+        self.assertEqual(os.stat(os.path.join(path, '.build.zip')).st_ino, os.stat(app.build_file.path).st_ino)
+        self.assertContains(self.client.get('/apps/demo/'), 'demo')
+        for threshold in (MemberReader.STREAM_THRESHOLD, 0):
+            with mock.patch.object(MemberReader, 'STREAM_THRESHOLD', threshold):
+                for name in ('static/js/big.js', 'static/js/main.1a2b3c4d.js'):
+                    response = self.client.get(f'/apps/demo/{name}')
+                    self.assertEqual(b''.join(response.streaming_content), files[name].encode())
+                    self.assertEqual(int(response['Content-Length']), len(files[name]))
+        etag = self.client.get('/apps/demo/manifest.json')['ETag']
+        self.assertEqual(self.client.get('/apps/demo/manifest.json', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_encrypted_members_are_not_served_from_the_archive(self):
+        # zipfile cannot encrypt, so set the encrypted flag on the central
+        # directory entries of a plain zip; that is what link_archive reads
+        data = bytearray(make_zip(BUILD))
+        offset = data.find(b'PK\x01\x02')
+        while offset != -1:
+            data[offset + 8] |= 0x1
+            offset = data.find(b'PK\x01\x02', offset + 4)
+        archive = os.path.join(self.media_root, 'build.zip')
+        with open(archive, 'wb') as f:
+            f.write(data)
+        dest = tempfile.mkdtemp(dir=self.media_root)
+        self.assertIsNone(link_archive(archive, dest))
+        self.assertEqual(os.listdir(dest), [])
+
+    def test_extraction_limits(self):
+        bomb = {'zeros.bin': b'\0' * (1024 * 1024)}
+        for data in (make_zip(bomb), make_tar(bomb)):
+            with self.assertRaisesMessage(ArchiveError, 'times its archive size'):
+                self.extract(data)
+        with override_settings(APP_MANAGER={'MAX_BUILD_FILES': 2}):
+            with self.assertRaisesMessage(ArchiveError, 'more than 2 files'):
+                self.extract(make_tar(BUILD))
+        with override_settings(APP_MANAGER={'MAX_BUILD_SIZE': 10}):
+            with self.assertRaisesMessage(ArchiveError, 'more than 10 bytes'):
+                self.extract(make_tar(BUILD))
+
+
+class SavePathTests(AppManagerTestCase):
+
+    def test_saves_without_a_new_build_file_skip_the_deploy(self):
+        app = App.objects.get(pk=self.deploy(self.create_app(), BUILD).pk)
+        with self.track_build_access() as touched, \
+                mock.patch('appmanager.builds.extract_archive') as extract, \
+                self.assertNumQueries(1), self.captureOnCommitCallbacks(execute=True):
+            app.status = 'stopped'
+            app.repo_url = 'https://example.com/other'
+            app.save()
+        extract.assert_not_called()
+        self.assertEqual(touched, [])
+        self.assertEqual(app.changed_fields(), set())
+        self.assertEqual(App.objects.get(pk=app.pk).status, 'stopped')
+
+    def test_deferred_and_refreshed_fields_are_not_changes(self):
+        app = self.deploy(self.create_app(), BUILD)
+        partial = App.objects.only('id', 'name').get(pk=app.pk)
+        self.assertEqual(partial.build_file.name, app.build_file.name)
+        self.assertEqual(partial.changed_fields(), set())
+        stale = App.objects.get(pk=app.pk)
+        with mock.patch('appmanager.signals.schedule_deploy') as scheduled, \
+                self.captureOnCommitCallbacks(execute=True):
+            partial.save()
+            scheduled.assert_not_called()
+            app = self.deploy(app, dict(BUILD, **{'index.html': '<html>v2</html>'}))
+            scheduled.reset_mock()
+            stale.refresh_from_db()
+            self.assertEqual(stale.changed_fields(), set())
+            stale.save()
+            scheduled.assert_not_called()
+        self.assertTrue(os.path.exists(app.build_file.path))
+
+    def test_reuploaded_build_file_is_deployed(self):
+        app = self.deploy(self.create_app(), BUILD)
+        first, old_zip = app.buildnumber, app.build_file.path
+        app = self.deploy(App.objects.get(pk=app.pk), dict(BUILD, **{'index.html': '<html>v2</html>'}))
+        self.assertGreater(app.buildnumber, first)
+        self.assertEqual(os.listdir(os.path.dirname(old_zip)), [os.path.basename(app.build_file.path)])
+        self.assertContains(self.client.get('/apps/demo/'), 'v2')
+
+
+class BlobStoreTests(AppManagerTestCase):
+
+    def test_unchanged_files_are_stored_once(self):
+        bundle = 'console.log("hello world");\n' * 200
+        files = dict(BUILD, **{'static/js/app.0f0f0f0f.js': bundle})
+        app = self.deploy(self.create_app(), files)
+        first = app.buildnumber
+        with mock.patch('appmanager.blobs.compress', wraps=blobs.compress) as compressed:
+            app = self.deploy(app, dict(files, **{'index.html': '<html>v2</html>'}))
+        compressed.assert_not_called()
+        for name in ('static/js/app.0f0f0f0f.js', 'static/js/app.0f0f0f0f.js.gz', 'manifest.json'):
+            old = os.stat(os.path.join(build_dir('demo', first), name))
+            new = os.stat(os.path.join(build_dir('demo', app.buildnumber), name))
+            self.assertEqual(old.st_ino, new.st_ino)
+        old = os.stat(os.path.join(build_dir('demo', first), 'index.html'))
+        new = os.stat(os.path.join(build_dir('demo', app.buildnumber), 'index.html'))
+        self.assertNotEqual(old.st_ino, new.st_ino)
+
+    @override_settings(APP_MANAGER={'DEPLOY_ASYNC': False, 'BLOB_GC_GRACE': 0})
+    def test_unreferenced_blobs_are_collected(self):
+        app = self.deploy(self.create_app(), BUILD)
+        self.deploy(self.create_app('other', build_file=None), {'manifest.json': '{}'})
+        # Only the blobs of the removed builds are checked, never the whole store
+        removed = blobs.build_blobs(build_dir('demo', app.buildnumber), app.buildnumber)
+        with mock.patch('appmanager.signals.collect_garbage', wraps=blobs.collect_garbage) as collected:
+            app.delete()
+        collected.assert_called_once_with(removed)
+        stored = [name for _, _, names in os.walk(blobs.store_dir()) for name in names]
+        self.assertEqual(stored, [hashlib.sha256(b'{}').hexdigest()])
+        stray = blobs.blob_path('0' * 64)
+        os.makedirs(os.path.dirname(stray))
+        open(stray, 'w').close()
+        blobs.collect_garbage()
+        self.assertFalse(os.path.exists(stray))
+
+    def test_store_is_outside_the_app_namespace(self):
+        self.deploy(self.create_app(), BUILD)
+        self.assertEqual(os.listdir(self.templates_dir), ['demo'])
+        for name in ('.blobs', '..', 'a/b', 'a\\b'):
+            serializer = AppSerializer(data={'name': name, 'repo_url': 'https://example.com/repo', 'subdomain': 'x'})
+            self.assertFalse(serializer.is_valid())
+            self.assertIn('name', serializer.errors)
+
+
+class AppListApiTests(AppManagerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.apps = [self.create_app(f'app{i}', status='running' if i % 2 else 'stopped') for i in range(5)]
+        other = User.objects.create_user(username='other')
+        App.objects.create(user=other, name='theirs', repo_url='https://example.com/repo', subdomain='theirs')
+
+    def test_cursor_pages_walk_apps_newest_first(self):
+        names, url = [], '/api/apps/?page_size=2'
+        while url:
+            page = self.api.get(url).data
+            self.assertLessEqual(len(page['results']), 2)
+            names += [app['name'] for app in page['results']]
+            url = page['next']
+        self.assertEqual(names, [f'app{i}' for i in reversed(range(5))])
+
+    def test_status_filter(self):
+        response = self.api.get('/api/apps/?status=running')
+        self.assertEqual({app['name'] for app in response.data['results']}, {'app1', 'app3'})
+        response = self.api.get('/api/apps/?status=running&status=stopped')
+        self.assertEqual(len(response.data['results']), 5)
+        response = self.api.get('/api/apps/?status=sleeping')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sleeping', response.data['error'])
+
+    def test_fields_narrow_serializer_and_select(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/api/apps/?fields=name,status')
+        self.assertEqual(response.data['results'][0], {'name': 'app4', 'status': 'stopped'})
+        select = next(query['sql'] for query in queries if 'appmanager_app' in query['sql'])
+        self.assertIn('"name"', select)
+        self.assertNotIn('build_file', select)
+        self.assertNotIn('repo_url', select)
+        response = self.api.get(f'/api/apps/{self.apps[0].pk}/?fields=buildnumber')
+        self.assertEqual(response.data, {'buildnumber': None})
+        self.assertEqual(self.api.get('/api/apps/?fields=name,secret').status_code, 400)
+        self.assertEqual(self.api.get('/api/apps/?fields=').status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SqliteProductionTests(TestCase):
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            default = cursor.fetchone()[0]
+            with override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234}):
+                configure_sqlite(sender=None, connection=connection)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 1234)
+            cursor.execute(f'PRAGMA busy_timeout = {default}')
+
+    def test_writes_are_retried_while_locked(self):
+        write = mock.Mock(side_effect=[OperationalError('database is locked')] * 2 + ['done'])
+        with mock.patch('pycms.db.time.sleep') as sleep, \
+                mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(retry_on_locked(write)(), 'done')
+            self.assertEqual(sleep.call_count, 2)
+            write.side_effect = [OperationalError('no such table: x'), 'done']
+            with self.assertRaises(OperationalError):
+                retry_on_locked(write)()
+            write.side_effect = [OperationalError('database is locked')] * 4
+            with self.assertRaises(OperationalError), override_settings(SQLITE_WRITE_RETRIES=2):
+                retry_on_locked(write)()
+        # Inside a transaction only the whole transaction can be retried
+        write.side_effect = [OperationalError('database is locked'), 'done']
+        with self.assertRaises(OperationalError):
+            retry_on_locked(write)()
+
+
+class DeployApiTests(AppManagerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.app = self.create_app()
+
+    def post_build(self, files=BUILD):
+        upload = SimpleUploadedFile('build.zip', make_zip(files))
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.api.post(f'/api/apps/{self.app.pk}/deploy/', {'build_file': upload})
+
+    def test_deploy_activates_build(self):
+        self.post_build()
+        state = self.api.get(f'/api/apps/{self.app.pk}/status/').data
+        self.assertEqual(state['status'], 'running')
+        self.assertIsNotNone(state['buildnumber'])
+        self.assertContains(self.client.get('/apps/demo/'), 'demo')
+
+    def test_broken_archive_marks_app_failed(self):
+        upload = SimpleUploadedFile('build.zip', b'not a zip')
+        with self.assertLogs('appmanager.builds', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            self.api.post(f'/api/apps/{self.app.pk}/deploy/', {'build_file': upload})
+        self.assertEqual(self.api.get(f'/api/apps/{self.app.pk}/status/').data['status'], 'failed')
+
+    def test_queued_deploy_returns_202(self):
+        with override_settings(APP_MANAGER={'DEPLOY_ASYNC': True}), \
+                mock.patch.object(tasks, '_get_executor') as executor:
+            response = self.post_build()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['app']['status'], 'deploying')
+        deployment = response.data['deployment']['id']
+        self.assertTrue(response.data['status_url'].endswith(f'/api/apps/{self.app.pk}/status/?deployment={deployment}'))
+        executor.return_value.submit.assert_called_once()
+
+    def test_queued_deploys_are_coalesced(self):
+        with override_settings(APP_MANAGER={'DEPLOY_ASYNC': True}), \
+                mock.patch.object(tasks, '_get_executor') as executor:
+            for version in range(3):
+                self.post_build(dict(BUILD, **{'index.html': f'<html>v{version}</html>'}))
+        with mock.patch('appmanager.builds.extract_archive', wraps=extract_archive) as extract:
+            for submitted in executor.return_value.submit.call_args_list:
+                submitted.args[0](*submitted.args[1:])
+        extract.assert_called_once()
+        statuses = list(self.app.deployments.order_by('pk').values_list('status', flat=True))
+        self.assertEqual(statuses, ['superseded', 'superseded', 'succeeded'])
+        self.assertEqual(len(list_builds('demo')), 1)
+        self.assertContains(self.client.get('/apps/demo/'), 'v2')
+        state = self.api.get(f'/api/apps/{self.app.pk}/status/').data
+        self.assertEqual(state['deployment']['status'], 'succeeded')
+        self.assertEqual(state['deployment']['buildnumber'], state['buildnumber'])
+        first = self.app.deployments.order_by('pk').first().pk
+        state = self.api.get(f'/api/apps/{self.app.pk}/status/?deployment={first}').data
+        self.assertEqual(state['deployment']['status'], 'superseded')
+        response = self.api.get(f'/api/apps/{self.app.pk}/status/?deployment=abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.data)
+
+    def test_deploys_lost_by_a_restarted_worker_are_reclaimed(self):
+        with override_settings(APP_MANAGER={'DEPLOY_ASYNC': True}), mock.patch.object(tasks, '_get_executor'):
+            self.post_build()
+        lost = self.app.deployments.get()
+        other = self.create_app('other')
+        Deployment.objects.create(app=other, status='running')
+        self.assertEqual(reclaim_stale_deployments(), 0)
+        Deployment.objects.update(created_at=timezone.now() - datetime.timedelta(hours=2))
+        with self.assertLogs('appmanager.builds', 'WARNING'):
+            self.assertEqual(reclaim_stale_deployments([other.pk]), 1)
+        self.assertEqual(App.objects.get(pk=other.pk).status, 'failed')
+        self.assertEqual(self.api.get(f'/api/apps/{self.app.pk}/status/').data['status'], 'deploying')
+        # The app's next deploy reclaims the one its worker lost
+        with self.assertLogs('appmanager.builds', 'WARNING'):
+            self.post_build()
+        lost.refresh_from_db()
+        self.assertEqual(lost.status, 'failed')
+        self.assertEqual(self.api.get(f'/api/apps/{self.app.pk}/status/').data['status'], 'running')
+
+    def test_deploys_of_an_app_hold_an_exclusive_lock(self):
+        acquired = threading.Event()
+
+        def deploy():
+            with deploy_lock('demo'):
+                acquired.set()
+
+        with deploy_lock('demo'):
+            worker = threading.Thread(target=deploy)
+            worker.start()
+            self.assertFalse(acquired.wait(0.2))
+        worker.join()
+        self.assertTrue(acquired.is_set())
+
+    def test_rollback_and_build_history(self):
+        self.post_build()
+        first = App.objects.get(pk=self.app.pk).buildnumber
+        self.post_build(dict(BUILD, **{'index.html': '<html>v2</html>'}))
+        history = self.api.get(f'/api/apps/{self.app.pk}/builds/').data
+        self.assertEqual([b['active'] for b in history], [True, False])
+        self.assertEqual(history[1]['buildnumber'], first)
+        self.assertGreater(history[1]['size'], 0)
+        last_modified = self.client.get('/apps/demo/')['Last-Modified']
+
+        later = timezone.now() + datetime.timedelta(minutes=1)
+        with mock.patch('appmanager.builds.extract_archive') as extract, \
+                mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.api.post(f'/api/apps/{self.app.pk}/rollback/')
+        extract.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['app']['buildnumber'], first)
+        # The rolled back page is newer to caches than the one it replaces
+        response = self.client.get('/apps/demo/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertContains(response, 'demo')
+        self.assertEqual(response['Last-Modified'], http_date(later.timestamp()))
+        response = self.api.post(f'/api/apps/{self.app.pk}/rollback/')
+        self.assertEqual(response.status_code, 400)
+        for buildnumber in ([first], 'abc', 1):
+            response = self.api.post(f'/api/apps/{self.app.pk}/rollback/', {'buildnumber': buildnumber}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.data)
+
+    def test_restart_reactivates_the_current_build(self):
+        self.post_build()
+        buildnumber = App.objects.get(pk=self.app.pk).buildnumber
+        App.objects.filter(pk=self.app.pk).update(status='stopped')
+        with mock.patch('appmanager.builds.extract_archive') as extract:
+            response = self.api.post(f'/api/apps/{self.app.pk}/restart/')
+        extract.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['app']['status'], 'running')
+        self.assertEqual(response.data['app']['buildnumber'], buildnumber)
+
+    def test_bulk_deploy_restart_and_undeploy(self):
+        other = self.create_app('other')
+        theirs = App.objects.create(
+            user=User.objects.create_user(username='stranger'), name='theirs',
+            repo_url='https://example.com/repo', subdomain='theirs',
+        )
+        uploads = {
+            str(app.pk): SimpleUploadedFile('build.zip', make_zip(dict(BUILD, **{'index.html': f'<html>{app.name}</html>'})))
+            for app in (self.app, other, theirs)
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post('/api/apps/bulk/deploy/', uploads)
+        self.assertEqual(response.status_code, 207)
+        results = {result['id']: result for result in response.data['results']}
+        self.assertEqual(results[str(theirs.pk)]['status'], 404)
+        self.assertEqual(results[str(self.app.pk)]['status'], 200)
+        self.assertContains(self.client.get('/apps/demo/'), 'demo')
+        self.assertContains(self.client.get('/apps/other/'), 'other')
+        self.assertFalse(list_builds('theirs'))
+        self.assertEqual(App.objects.get(pk=other.pk).deployments.get().status, 'succeeded')
+
+        App.objects.filter(pk__in=[self.app.pk, other.pk]).update(status='stopped')
+        shutil.rmtree(build_dir('other', App.objects.get(pk=other.pk).buildnumber))
+        ids = [str(self.app.pk), str(other.pk), 'not-an-id']
+        with mock.patch('appmanager.builds.extract_archive', wraps=extract_archive) as extract, \
+                mock.patch('appmanager.views.activate_build', wraps=activate_build) as activated, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post('/api/apps/bulk/restart/', {'ids': ids}, format='json')
+        self.assertEqual(extract.call_count, 1)
+        # Retained builds are reactivated exactly as a single restart does it
+        self.assertEqual([call.args[0].pk for call in activated.call_args_list], [self.app.pk])
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 200, 404])
+        self.assertEqual(set(App.objects.values_list('status', flat=True).filter(user=self.user)), {'running'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post('/api/apps/bulk/undeploy/', {'ids': ids[:2] + [str(theirs.pk)]}, format='json')
+        self.assertEqual([result['status'] for result in response.data['results']], [204, 204, 404])
+        self.assertFalse(App.objects.filter(user=self.user).exists())
+        self.assertFalse(os.path.exists(os.path.join(self.templates_dir, 'demo')))
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'app_builds')), [])
+        self.assertTrue(App.objects.filter(pk=theirs.pk).exists())
+
+    def test_bulk_validation(self):
+        self.assertEqual(self.api.post('/api/apps/bulk/restart/', {'ids': []}, format='json').status_code, 400)
+        self.assertEqual(self.api.post('/api/apps/bulk/deploy/', {}).status_code, 400)
+        with override_settings(APP_MANAGER={'BULK_MAX_APPS': 1}):
+            response = self.api.post('/api/apps/bulk/undeploy/', {'ids': [str(self.app.pk)] * 2}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(App.objects.filter(pk=self.app.pk).exists())
+
+    def test_delta_deploy_uploads_only_missing_contents(self):
+        self.post_build()
+        files = dict(BUILD, **{'index.html': '<html>delta</html>'})
+        manifest = {'files': {path: hashlib.sha256(content.encode()).hexdigest() for path, content in files.items()}}
+        url = f'/api/apps/{self.app.pk}/deploy'
+        missing = self.api.post(f'{url}/plan/', manifest, format='json').data['missing']
+        self.assertEqual(missing, [manifest['files']['index.html']])
+        self.assertEqual(self.api.post(f'{url}/commit/', manifest, format='json').status_code, 409)
+
+        upload = {missing[0]: SimpleUploadedFile('index.html', b'<html>delta</html>')}
+        self.assertEqual(self.api.post(f'/api/apps/{self.app.pk}/blobs/', upload).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api.post(f'{url}/commit/', manifest, format='json')
+        self.assertContains(self.client.get('/apps/demo/'), 'delta')
+        self.assertEqual(self.client.get('/apps/demo/manifest.json').status_code, 200)
+
+    def test_delta_deploy_rejects_bad_input(self):
+        url = f'/api/apps/{self.app.pk}'
+        manifest = {'files': {'../escape.js': 'a' * 64}}
+        self.assertEqual(self.api.post(f'{url}/deploy/plan/', manifest, format='json').status_code, 400)
+        upload = {'b' * 64: SimpleUploadedFile('x.js', b'not matching')}
+        self.assertEqual(self.api.post(f'{url}/blobs/', upload).status_code, 400)
+        self.assertEqual([names for _, _, names in os.walk(blobs.store_dir()) if names], [])
+        # Paths that need a file to also be a directory
+        digest = hashlib.sha256(b'x').hexdigest()
+        self.assertEqual(self.api.post(f'{url}/blobs/', {digest: SimpleUploadedFile('x', b'x')}).status_code, 200)
+        for files in ({'a': digest, 'a/b.js': digest}, {'static/js/a.js/b.js': digest, 'static/js/a.js': digest},
+                      {'a.js': digest, './a.js': digest}):
+            response = self.api.post(f'{url}/deploy/commit/', {'files': files}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.data)
+
+    def test_resumable_chunked_upload(self):
+        archive = make_zip(BUILD)
+        url = f'/api/apps/{self.app.pk}/uploads/'
+        upload_id = self.api.post(url, {'filename': 'build.zip', 'size': len(archive)}, format='json').data['upload_id']
+        url = f'{url}{upload_id}/'
+        half = len(archive) // 2
+        put = lambda offset, data: self.api.put(
+            f'{url}?offset={offset}', data, content_type='application/octet-stream'
+        )
+        self.assertEqual(put(0, archive[:half]).data['offset'], half)
+        # A retried chunk is refused and the client is told where to resume
+        response = put(0, archive[:half])
+        self.assertEqual((response.status_code, response.data['offset']), (409, half))
+        self.assertEqual(self.api.get(url).data['offset'], half)
+        self.assertEqual(self.api.post(f'{url}finalize/', {'sha256': 'a' * 64}, format='json').status_code, 409)
+        put(half, archive[half:])
+        self.assertEqual(self.api.post(f'{url}finalize/', {'sha256': 'a' * 64}, format='json').status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post(
+                f'{url}finalize/', {'sha256': hashlib.sha256(archive).hexdigest()}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.api.get(url).status_code, 404)
+        self.assertContains(self.client.get('/apps/demo/'), 'demo')
+
+    def test_overlapping_chunks_are_written_once(self):
+        archive = make_zip(BUILD)
+        upload_id = uploads.start_upload(self.app, 'build.zip', len(archive))['upload_id']
+        first_read, release = threading.Event(), threading.Event()
+
+        class SlowStream(io.BytesIO):
+            def read(self, size=-1):
+                data = super().read(size)
+                if not data:
+                    first_read.set()
+                    release.wait(5)
+                return data
+
+        outcomes = []
+
+        def put(stream):
+            try:
+                outcomes.append(uploads.append_chunk(self.app, upload_id, 0, stream)['offset'])
+            except uploads.OffsetMismatch as e:
+                outcomes.append(f'409 at {e.offset}')
+
+        slow = threading.Thread(target=put, args=(SlowStream(archive),))
+        slow.start()
+        first_read.wait(5)
+        retried = threading.Thread(target=put, args=(io.BytesIO(archive),))
+        retried.start()
+        # The retry waits for the lock the first PUT holds, then finds the chunk already there
+        retried.join(0.2)
+        release.set()
+        slow.join()
+        retried.join()
+        self.assertEqual(outcomes, [len(archive), f'409 at {len(archive)}'])
+        state = uploads.upload_state(self.app, upload_id)
+        self.assertEqual(state['offset'], len(archive))
+        name = uploads.finish_upload(self.app, upload_id, hashlib.sha256(archive).hexdigest())
+        self.assertTrue(name.endswith('.zip'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ParallelBulkDeployTests(ScratchSiteMixin, TransactionTestCase):
+
+    def test_bulk_deploys_extract_side_by_side(self):
+        apps = [self.create_app(name) for name in ('one', 'two')]
+        both_extracting = threading.Barrier(2, timeout=10)
+
+        def extract(*args, **kwargs):
+            both_extracting.wait()
+            return extract_archive(*args, **kwargs)
+
+        api = APIClient()
+        api.force_authenticate(self.user)
+        uploads = {str(app.pk): SimpleUploadedFile('build.zip', make_zip(BUILD)) for app in apps}
+        with mock.patch('appmanager.builds.extract_archive', side_effect=extract):
+            response = api.post('/api/apps/bulk/deploy/', uploads)
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 200])
+        self.assertEqual(set(App.objects.values_list('status', flat=True)), {'running'})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchmarkTests(TransactionTestCase):
+    """
+    Suites that query from their own threads, which need a database shared
+    between connections.
+    """
+
+    def run_suite(self, *args):
+        out = io.StringIO()
+        call_command('benchmark', *args, '--json', '-', stdout=out, stderr=io.StringIO())
+        return json.loads(out.getvalue())['results']
+
+    def test_deploy_benchmark(self):
+        results = self.run_suite('deploy', '--files', '5', '--deploys', '2', '--concurrency', '1')
+        self.assertEqual(set(results), {'build file', 'files'})
+        self.assertEqual(results['files']['calls'], 2)
+        self.assertGreater(results['build file']['queries_per_call'], 0)
+        self.assertFalse(App.objects.exists())
+
+    def test_benchmarks_leave_the_database_and_cache_alone(self):
+        database, stamp = connection.settings_dict['NAME'], cache.get('appmanager:apps:stamp')
+        with bench.scratch_site() as user:
+            self.assertNotEqual(connection.settings_dict['NAME'], database)
+            bench.create_app(user)
+            self.assertIsNotNone(cache.get('appmanager:apps:stamp'))
+        self.assertEqual(connection.settings_dict['NAME'], database)
+        self.assertFalse(User.objects.exists())
+        self.assertEqual(cache.get('appmanager:apps:stamp'), stamp)
+
+    def test_serve_benchmark(self):
+        results = self.run_suite('serve', '--files', '5', '--requests', '20', '--concurrency', '2')
+        self.assertEqual(set(results), {'wsgi', 'asgi sync view', 'asgi async view', 'wsgi server'})
+        self.assertEqual(results['wsgi server']['calls'], 20)
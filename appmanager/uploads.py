@@ -0,0 +1,132 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+import uuid
+from django.conf import settings
+from django.core.files.storage import default_storage
+from pycms.cache import LRUCache
+from .conf import get_setting
+from .manifest import file_digest
+from .models import App
+
+BUILDS_UPLOAD_TO = App._meta.get_field('build_file').upload_to
+
+# upload id -> (offset, running sha256) for uploads whose chunks reached this worker in order
+_hashers = LRUCache(maxsize=64)
+
+class OffsetMismatch(ValueError):
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+def _uploads_dir():
+    # Next to the stored build archives, so finishing an upload is a rename
+    return os.path.join(settings.MEDIA_ROOT, BUILDS_UPLOAD_TO, '.uploads')
+
+def _upload_path(upload_id, suffix=''):
+    return os.path.join(_uploads_dir(), f'{upload_id}{suffix}')
+
+def _read_meta(app, upload_id):
+    try:
+        with open(_upload_path(upload_id, '.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise FileNotFoundError(f"Unknown upload '{upload_id}'")
+    if meta['app'] != str(app.pk):
+        raise FileNotFoundError(f"Unknown upload '{upload_id}'")
+    return meta
+
+def start_upload(app, filename, size=None):
+    """
+    Begin a resumable upload of a build archive and return its state.
+    """
+    _remove_expired()
+    os.makedirs(_uploads_dir(), exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    meta = {'app': str(app.pk), 'filename': os.path.basename(filename), 'size': size, 'created': time.time()}
+    open(_upload_path(upload_id), 'wb').close()
+    with open(_upload_path(upload_id, '.json'), 'w') as f:
+        json.dump(meta, f)
+    _hashers.set(upload_id, (0, hashlib.sha256()))
+    return {'upload_id': upload_id, 'offset': 0, 'size': size}
+
+def upload_state(app, upload_id):
+    meta = _read_meta(app, upload_id)
+    return {'upload_id': upload_id, 'offset': os.path.getsize(_upload_path(upload_id)), 'size': meta['size']}
+
+def append_chunk(app, upload_id, offset, stream, chunk_size=64 * 1024):
+    """
+    Append the body of a request to the upload, hashing while writing.
+    The client's offset must match what the server has, checked under an
+    exclusive lock on the upload, so a retried or resumed chunk can never
+    be written twice. A chunk that fails halfway is cut off again.
+    """
+    meta = _read_meta(app, upload_id)
+    path = _upload_path(upload_id)
+    with open(path, 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise OffsetMismatch(current)
+            state = _hashers.get(upload_id)
+            hasher = state[1].copy() if state is not None and state[0] == offset else None
+            written = 0
+            try:
+                for chunk in iter(lambda: stream.read(chunk_size), b''):
+                    if meta['size'] is not None and offset + written + len(chunk) > meta['size']:
+                        raise ValueError(f"Upload exceeds its declared size of {meta['size']} bytes")
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    f.write(chunk)
+                    written += len(chunk)
+                f.flush()
+            except BaseException:
+                f.truncate(offset)
+                raise
+            if hasher is not None:
+                _hashers.set(upload_id, (offset + written, hasher))
+            else:
+                # Earlier chunks went to another worker; the digest is computed from disk at the end
+                _hashers.pop(upload_id)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return {'upload_id': upload_id, 'offset': offset + written, 'size': meta['size']}
+
+def finish_upload(app, upload_id, sha256):
+    """
+    Verify a complete upload and move it into the build archive storage.
+    Returns the archive's storage name, ready to be set as App.build_file.
+    """
+    meta = _read_meta(app, upload_id)
+    path = _upload_path(upload_id)
+    size = os.path.getsize(path)
+    if meta['size'] is not None and size != meta['size']:
+        raise OffsetMismatch(size)
+    state = _hashers.pop(upload_id)
+    if state is not None and state[0] == size:
+        digest = state[1].hexdigest()
+    else:
+        digest = file_digest(path)
+    if digest != (sha256 or '').lower():
+        raise ValueError('Checksum does not match the uploaded data')
+    name = default_storage.get_available_name(os.path.join(BUILDS_UPLOAD_TO, meta['filename']))
+    os.replace(path, default_storage.path(name))
+    os.remove(_upload_path(upload_id, '.json'))
+    return name
+
+def _remove_expired():
+    cutoff = time.time() - get_setting('UPLOAD_EXPIRY')
+    try:
+        names = os.listdir(_uploads_dir())
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(_uploads_dir(), name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
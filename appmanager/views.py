@@ -1,60 +1,387 @@
+import functools
+import io
 import os
-import mimetypes
+import posixpath
+import re
+import shutil
+import uuid
+from urllib.parse import quote
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import FileResponse, Http404
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
 from django.template.exceptions import TemplateDoesNotExist
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import content_disposition_header, http_date, quote_etag
 from django.views.decorators.common import no_append_slash
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.reverse import reverse
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from .archives import open_member
+from .blobs import add_blob, collect_garbage, has_blob, materialize
+from .builds import (
+    activate_build, build_history, new_staging_dir, previous_build, remove_app_files, schedule_deploy,
+    schedule_deploys,
+)
+from . import uploads
+from .cache import acached_index, aresolve_app, cached_index, resolve_app
+from .compression import ENCODINGS, choose_encoding
+from .conf import get_setting
+from .manifest import aget_manifest, get_manifest
 from .models import App
-from .serializers import AppSerializer
-import shutil
+from .pagination import AppCursorPagination
+from .paths import list_builds, safe_relpath
+from .serializers import AppSerializer, DeploymentSerializer
+from .signals import deferred_removal
+from .tasks import map_parallel
+
+SHA256_RE = re.compile(r'[0-9a-f]{64}')
+
+UUID_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+# Assets larger than this are streamed to ASGI clients in chunks of this size
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Single byte ranges: "bytes=first-last", "bytes=first-" or "bytes=-suffix_length"
+BYTE_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
 
-ASSET_EXTENSIONS = {'.json', '.ico', '.png', '.jpg', '.jpeg', '.svg', '.webmanifest', '.txt', '.js', '.css'}
+# Paths with these extensions that are not in the build are 404s instead of client-side routes
+ASSET_EXTENSIONS = {
+    '.json', '.ico', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.svg', '.webmanifest', '.txt',
+    '.js', '.mjs', '.css', '.map', '.wasm', '.woff2', '.woff', '.ttf', '.otf', '.mp4', '.webm', '.mp3', '.pdf',
+}
 
 @no_append_slash
 def serve_static_app(request, app_name, subpath=None):
     """
     Serve the React app's index.html or static assets like manifest.json, favicon, etc.
     """
-    try:
-        app = App.objects.get(name=app_name)
-        templates_dir = os.path.join(settings.TEMPLATES_DIR, app_name)
-        # If subpath is an asset, serve it directly from the templates directory
-        if subpath:
-            ext = os.path.splitext(subpath)[1].lower()
-            if ext and ext in ASSET_EXTENSIONS:
-                asset_path = os.path.join(templates_dir, subpath)
-                if os.path.isfile(asset_path):
-                    content_type, _ = mimetypes.guess_type(asset_path)
-                    return FileResponse(open(asset_path, 'rb'), content_type=content_type)
-                else:
-                    raise Http404(f"Asset '{subpath}' not found for app '{app_name}'.")
-        # Otherwise, serve the React app's index.html (versioned or fallback)
-        template_names = []
-        if app.buildnumber:
-            template_names.append(f'{app_name}/index_{app.buildnumber}.html')
-        template_names.append(f'{app_name}/index.html')
-        for template_name in template_names:
-            try:
-                return render(request, template_name)
-            except TemplateDoesNotExist:
-                continue
-        raise Http404(f"The app '{app_name}' does not have a valid index.html template.")
-    except App.DoesNotExist:
+    app = resolve_app(app_name)
+    if app is None:
+        raise Http404(f"The app '{app_name}' does not exist.")
+    manifest = get_manifest(app)
+    # If subpath is a file of the build, serve it from the templates directory
+    asset = _find_asset(manifest, app, subpath)
+    if asset is not None:
+        return _serve_asset(request, app, subpath, asset)
+    # Otherwise, serve the React app's index.html (versioned or fallback)
+    if app.cache_index:
+        response = _serve_cached_index(request, app)
+    else:
+        response = _render_index_response(request, app)
+    return _patch_preload(response, manifest)
+
+@no_append_slash
+async def aserve_static_app(request, app_name, subpath=None):
+    """
+    serve_static_app() for ASGI. Apps, manifests and rendered pages are looked
+    up in memory, and assets are streamed in chunks read on worker threads, so
+    one worker can keep thousands of downloads going at once.
+    """
+    app = await aresolve_app(app_name)
+    if app is None:
         raise Http404(f"The app '{app_name}' does not exist.")
+    manifest = await aget_manifest(app)
+    asset = _find_asset(manifest, app, subpath)
+    if asset is not None:
+        return _serve_asset(request, app, subpath, asset, asynchronous=True)
+    if app.cache_index:
+        etag, response = _check_index(request, app)
+        if response is None:
+            response = HttpResponse(await acached_index(app, lambda: _render_index(app)))
+        response = _patch_index_headers(response, app, etag)
+    else:
+        response = await sync_to_async(_render_index_response)(request, app)
+    return _patch_preload(response, manifest)
+
+def _find_asset(manifest, app, subpath):
+    """
+    Return the manifest entry to serve for subpath, or None to serve index.html.
+    Every file of the build is an asset except HTML pages, which are rendered
+    as the index.
+    """
+    if not subpath:
+        return None
+    ext = os.path.splitext(subpath)[1].lower()
+    asset = manifest['files'].get(subpath)
+    if asset is not None and ext != '.html':
+        return asset
+    if ext in ASSET_EXTENSIONS:
+        raise Http404(f"Asset '{subpath}' not found for app '{app.name}'.")
+    return None
+
+def _render_index_response(request, app):
+    for template_name in app.index_templates:
+        try:
+            return render(request, template_name)
+        except TemplateDoesNotExist:
+            continue
+    raise Http404(f"The app '{app.name}' does not have a valid index.html template.")
+
+def _render_index(app):
+    for template_name in app.index_templates:
+        try:
+            return render_to_string(template_name).encode()
+        except TemplateDoesNotExist:
+            continue
+    raise Http404(f"The app '{app.name}' does not have a valid index.html template.")
+
+def _serve_cached_index(request, app):
+    """
+    Serve index.html rendered once per build without request context.
+    The page only changes with the build, so the buildnumber validates it.
+    """
+    etag, response = _check_index(request, app)
+    if response is None:
+        response = HttpResponse(cached_index(app, lambda: _render_index(app)))
+    return _patch_index_headers(response, app, etag)
+
+def _check_index(request, app):
+    """
+    Return the index ETag and, if the client's copy is current, the 304 to send.
+    """
+    if not app.buildnumber:
+        return None, None
+    etag = quote_etag(f'{app.name}-{app.buildnumber}')
+    return etag, get_conditional_response(request, etag=etag, last_modified=app.last_deployed)
+
+def _patch_index_headers(response, app, etag):
+    if etag:
+        response['ETag'] = etag
+        if app.last_deployed:
+            response['Last-Modified'] = http_date(app.last_deployed)
+    _patch_max_age(response, get_setting('INDEX_MAX_AGE'))
+    return response
+
+def _patch_preload(response, manifest):
+    """
+    Announce the bundles index.html needs as preload Link headers, worked
+    out at deploy time. CDNs and proxies that support it turn them into
+    103 Early Hints, so the browser starts fetching before the page arrives.
+    """
+    links = manifest.get('preload')
+    if links and 'Link' not in response:
+        response['Link'] = ', '.join(links)
+    return response
+
+def _serve_asset(request, app, subpath, asset, asynchronous=False):
+    """
+    Serve a manifest entry, answering conditional requests with 304 before the file is opened.
+    Precompressed variants are picked from Accept-Encoding; each gets its own ETag.
+    """
+    encodings = asset.get('encodings')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'), encodings)
+    etag = quote_etag(f"{asset['hash']}-{encoding}" if encoding else asset['hash'])
+    response = get_conditional_response(request, etag=etag, last_modified=asset['mtime'])
+    if response is None:
+        response = _asset_response(request, app, subpath, asset, encoding, etag, asynchronous)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    if encodings:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(asset['mtime'])
+    if re.search(get_setting('HASHED_ASSET_PATTERN'), os.path.basename(subpath)):
+        patch_cache_control(response, public=True, max_age=get_setting('HASHED_ASSET_MAX_AGE'), immutable=True)
+    else:
+        _patch_max_age(response, get_setting('ASSET_MAX_AGE'))
+    return response
+
+def _asset_response(request, app, subpath, asset, encoding, etag, asynchronous):
+    """
+    Hand the file to the front-end server when SENDFILE_BACKEND is set;
+    otherwise send it from here, whole or as the single byte range asked for.
+    Async responses are read in chunks on worker threads between sends, so
+    no thread is held for the whole download.
+    """
+    filename = os.path.basename(subpath)
+    if app.archive:
+        # Archive members have no file of their own to hand off
+        size = asset['size']
+        opener = functools.partial(open_member, app.archive, subpath)
+    else:
+        path = _asset_path(app, subpath, encoding)
+        backend = get_setting('SENDFILE_BACKEND')
+        if backend:
+            return _sendfile_response(path, asset['content_type'], filename, backend)
+        size = asset['encodings'][encoding] if encoding else asset['size']
+        opener = functools.partial(open, path, 'rb')
+    byte_range = _byte_range(request, size, etag, asset['mtime'])
+    if byte_range is False:
+        response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range is None and not asynchronous:
+        # FileResponse lets WSGI servers send the file with sendfile()
+        response = FileResponse(opener(), content_type=asset['content_type'], filename=filename)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1
+        chunks = (_read_chunks if asynchronous else _iter_range)(opener, start, length)
+        response = StreamingHttpResponse(chunks, content_type=asset['content_type'])
+        response['Content-Length'] = length
+        response['Content-Disposition'] = content_disposition_header(False, filename)
+        if byte_range:
+            response.status_code = status.HTTP_206_PARTIAL_CONTENT
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+def _asset_path(app, subpath, encoding=None):
+    asset_path = os.path.join(app.build_dir, subpath)
+    if encoding:
+        asset_path += dict(ENCODINGS)[encoding]
+    return asset_path
+
+def _sendfile_response(path, content_type, filename, backend):
+    """
+    Empty response telling nginx (X-Accel-Redirect) or Apache/lighttpd
+    (X-Sendfile) to send the file, ranges included, itself.
+    """
+    response = HttpResponse(content_type=content_type)
+    response['Content-Disposition'] = content_disposition_header(False, filename)
+    if backend == 'nginx':
+        relpath = os.path.relpath(path, settings.TEMPLATES_DIR).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = get_setting('SENDFILE_URL_PREFIX').rstrip('/') + '/' + quote(relpath)
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+def _byte_range(request, size, etag, last_modified):
+    """
+    Return (first, last) byte of the single range requested, None to send the
+    whole asset (no or unsupported Range, or a stale If-Range) or False if
+    the range cannot be satisfied.
+    """
+    header = request.headers.get('Range')
+    if not header or request.method != 'GET':
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range not in (etag, http_date(last_modified)):
+        return None
+    match = BYTE_RANGE_RE.fullmatch(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+        return (start, end) if start < size else False
+    if last and int(last) > 0 and size:
+        return max(0, size - int(last)), size - 1
+    return False if last else None
+
+def _open_at(opener, start, chunk_size=STREAM_CHUNK_SIZE):
+    f = opener()
+    if f.seekable():
+        f.seek(start)
+    else:
+        # Archive members can only be read from the start
+        while start > 0:
+            skipped = len(f.read(min(chunk_size, start)))
+            if not skipped:
+                break
+            start -= skipped
+    return f
+
+def _read_range(f, length):
+    parts = []
+    while length > 0:
+        chunk = f.read(length)
+        if not chunk:
+            break
+        parts.append(chunk)
+        length -= len(chunk)
+    return b''.join(parts)
+
+def _iter_range(opener, start, length, chunk_size=STREAM_CHUNK_SIZE):
+    with _open_at(opener, start) as f:
+        while length > 0:
+            chunk = _read_range(f, min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+async def _read_chunks(opener, start, length, chunk_size=STREAM_CHUNK_SIZE):
+    if length <= chunk_size:
+        # Small files, the common case, cost a single trip to a worker thread
+        yield await sync_to_async(_read_whole_range, thread_sensitive=False)(opener, start, length)
+        return
+    f = await sync_to_async(_open_at, thread_sensitive=False)(opener, start)
+    try:
+        while length > 0:
+            chunk = await sync_to_async(_read_range, thread_sensitive=False)(f, min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def _read_whole_range(opener, start, length):
+    with _open_at(opener, start) as f:
+        return _read_range(f, length)
+
+def _patch_max_age(response, max_age):
+    if max_age:
+        patch_cache_control(response, public=True, max_age=max_age)
+    else:
+        patch_cache_control(response, no_cache=True)
+
+def _app_key(app_id):
+    # App ids as the bulk endpoints report them: canonical UUIDs where they parse
+    try:
+        return str(uuid.UUID(str(app_id)))
+    except ValueError:
+        return str(app_id)
 
 class AppViewSet(viewsets.ModelViewSet):
     queryset = App.objects.all()
     serializer_class = AppSerializer
+    pagination_class = AppCursorPagination
     parser_classes = (MultiPartParser, FormParser)
 
     def get_queryset(self):
         # Filter apps by current user
-        return App.objects.filter(user=self.request.user)
+        queryset = App.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            statuses = self.request.query_params.getlist('status')
+            if statuses:
+                unknown = set(statuses) - {value for value, _ in App.STATUS_CHOICES}
+                if unknown:
+                    raise ValidationError({'error': f"Unknown status: {', '.join(sorted(unknown))}"})
+                queryset = queryset.filter(status__in=statuses)
+        fields = self.requested_fields()
+        if fields is not None:
+            # Load only what is serialized, plus what the pagination orders by
+            queryset = queryset.only(*({'id', 'created_at'} | set(fields)))
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def requested_fields(self):
+        """
+        Fields asked for with ?fields=name,status on list and retrieve, or None for all.
+        """
+        if self.action not in ('list', 'retrieve') or 'fields' not in self.request.query_params:
+            return None
+        fields = [name for name in self.request.query_params['fields'].split(',') if name]
+        if not fields:
+            raise ValidationError({'error': 'fields must name at least one field'})
+        unknown = set(fields) - set(AppSerializer.Meta.fields)
+        if unknown:
+            raise ValidationError({'error': f"Unknown fields: {', '.join(sorted(unknown))}"})
+        return fields
 
     def perform_create(self, serializer):
         # Auto-set the user to the current user
@@ -75,14 +402,8 @@ class AppViewSet(viewsets.ModelViewSet):
         if 'build_file' in request.FILES:
             build_file = request.FILES['build_file']
             app.build_file = build_file
-            app.save()
-            return Response(
-                {
-                    'message': f"App '{app.name}' deployed successfully",
-                    'app': AppSerializer(app).data
-                },
-                status=status.HTTP_200_OK
-            )
+            app.save()  # Queues extraction through the post_save signal
+            return self._deploy_response(app, f"App '{app.name}' deployed successfully")
         
         # Check for multiple files (directory upload)
         files = request.FILES.getlist('files')
@@ -97,42 +418,172 @@ class AppViewSet(viewsets.ModelViewSet):
     def _deploy_from_files(self, app, files):
         """
         Deploy app from multiple uploaded files.
-        Reconstructs the directory structure in the templates directory.
+        Reconstructs the directory structure in a new build directory.
         """
+        staging_dir = None
         try:
-            templates_dir = os.path.join(settings.BASE_DIR, 'templates', 'apps', app.name)
-            os.makedirs(templates_dir, exist_ok=True)
+            # Assemble the build in a staging directory; it goes live once complete
+            staging_dir = new_staging_dir(app.name)
             
-            # Save all files to the templates directory, preserving relative paths
+            # Save all files to the staging directory, preserving relative paths
             for file in files:
-                file_path = os.path.join(templates_dir, file.name)
+                file_path = os.path.join(staging_dir, file.name)
                 os.makedirs(os.path.dirname(file_path), exist_ok=True)
                 with open(file_path, 'wb') as f:
                     for chunk in file.chunks():
                         f.write(chunk)
             
-            # Create versioned index.html
-            index_html_path = os.path.join(templates_dir, 'index.html')
-            if os.path.exists(index_html_path):
-                import time
-                buildnumber = int(time.time())
-                App.objects.filter(pk=app.pk).update(buildnumber=buildnumber)
-                versioned_template = os.path.join(templates_dir, f'index_{buildnumber}.html')
-                shutil.copy2(index_html_path, versioned_template)
-            
-            return Response(
-                {
-                    'message': f"App '{app.name}' deployed successfully from files",
-                    'app': AppSerializer(app).data
-                },
-                status=status.HTTP_200_OK
-            )
+            # Versioning, compression and the manifest run on the deploy worker pool
+            schedule_deploy(app, staging_dir)
+            return self._deploy_response(app, f"App '{app.name}' deployed successfully from files")
         except Exception as e:
+            if staging_dir:
+                shutil.rmtree(staging_dir, ignore_errors=True)
             return Response(
                 {'error': f'Failed to deploy: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=True, methods=['post'], url_path='deploy/plan', parser_classes=(JSONParser,))
+    def deploy_plan(self, request, pk=None):
+        """
+        First step of a delta deploy: given the new build's manifest, tell the
+        client which file contents the server does not have yet.
+        Endpoint: POST /api/apps/{id}/deploy/plan/ {"files": {"<path>": "<sha256>", ...}}
+        """
+        self.get_object()
+        try:
+            files = self._parse_build_manifest(request.data)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        missing = sorted({digest for digest in files.values() if not has_blob(digest)})
+        return Response({'missing': missing}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'], parser_classes=(MultiPartParser, FormParser))
+    def blobs(self, request, pk=None):
+        """
+        Second step of a delta deploy: upload the missing file contents, each
+        in a form field named after its sha256.
+        Endpoint: POST /api/apps/{id}/blobs/
+        """
+        self.get_object()
+        stored, rejected = [], []
+        for field, file in request.FILES.items():
+            digest = add_blob(file.chunks(), expected=field.lower())
+            (stored if digest == field.lower() else rejected).append(field)
+        if rejected:
+            return Response(
+                {'error': 'Content does not match its hash', 'rejected': rejected, 'stored': stored},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'stored': stored}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'], url_path='deploy/commit', parser_classes=(JSONParser,))
+    def deploy_commit(self, request, pk=None):
+        """
+        Last step of a delta deploy: assemble the build from stored contents and activate it.
+        Endpoint: POST /api/apps/{id}/deploy/commit/ {"files": {"<path>": "<sha256>", ...}}
+        """
+        app = self.get_object()
+        try:
+            files = self._parse_build_manifest(request.data)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        missing = sorted({digest for digest in files.values() if not has_blob(digest)})
+        if missing:
+            return Response(
+                {'error': 'Upload the missing contents first', 'missing': missing},
+                status=status.HTTP_409_CONFLICT
+            )
+        staging_dir = new_staging_dir(app.name)
+        try:
+            materialize(staging_dir, files)
+        except FileNotFoundError:
+            # A blob was garbage collected since the check; the client has to plan again
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return Response({'error': 'Build contents changed, plan again'}, status=status.HTTP_409_CONFLICT)
+        schedule_deploy(app, staging_dir, files)
+        return self._deploy_response(app, f"App '{app.name}' deployed successfully from stored files")
+
+    def _parse_build_manifest(self, data):
+        files = data.get('files') if isinstance(data, dict) else None
+        if not isinstance(files, dict) or not files:
+            raise ValueError('files must map build paths to sha256 hashes')
+        parsed = {}
+        for path, digest in files.items():
+            if not isinstance(digest, str) or not SHA256_RE.fullmatch(digest.lower()):
+                raise ValueError(f"Invalid sha256 for '{path}'")
+            relpath = safe_relpath(path)
+            if relpath in parsed:
+                raise ValueError(f"Build path '{path}' is listed twice")
+            parsed[relpath] = digest.lower()
+        # A path cannot be a file and the directory of another file at once
+        for relpath in parsed:
+            parent = posixpath.dirname(relpath)
+            while parent:
+                if parent in parsed:
+                    raise ValueError(f"Build path '{parent}' is both a file and a directory")
+                parent = posixpath.dirname(parent)
+        return parsed
+
+    @action(detail=True, methods=['post'], url_path='uploads', parser_classes=(JSONParser, FormParser))
+    def start_upload(self, request, pk=None):
+        """
+        Start a resumable upload of a large build archive.
+        Endpoint: POST /api/apps/{id}/uploads/ {"filename": "build.zip", "size": <optional bytes>}
+        """
+        app = self.get_object()
+        size = request.data.get('size')
+        try:
+            size = int(size) if size not in (None, '') else None
+        except (TypeError, ValueError):
+            return Response({'error': 'size must be a number of bytes'}, status=status.HTTP_400_BAD_REQUEST)
+        state = uploads.start_upload(app, request.data.get('filename') or 'build.zip', size)
+        return Response(state, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get', 'put'], url_path=r'uploads/(?P<upload_id>[0-9a-f]{32})')
+    def upload_chunk(self, request, pk=None, upload_id=None):
+        """
+        GET reports how many bytes the server has, so an interrupted upload can resume.
+        PUT appends the raw request body at ?offset=<bytes already uploaded>.
+        Endpoint: /api/apps/{id}/uploads/{upload_id}/
+        """
+        app = self.get_object()
+        try:
+            if request.method == 'GET':
+                return Response(uploads.upload_state(app, upload_id), status=status.HTTP_200_OK)
+            offset = int(request.query_params.get('offset', ''))
+            state = uploads.append_chunk(app, upload_id, offset, request.stream or io.BytesIO())
+        except FileNotFoundError as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except uploads.OffsetMismatch as e:
+            return Response({'error': str(e), 'offset': e.offset}, status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(state, status=status.HTTP_200_OK)
+
+    @action(
+        detail=True, methods=['post'], url_path=r'uploads/(?P<upload_id>[0-9a-f]{32})/finalize',
+        parser_classes=(JSONParser, FormParser),
+    )
+    def finalize_upload(self, request, pk=None, upload_id=None):
+        """
+        Check the upload against its sha256 and deploy it as the app's build file.
+        Endpoint: POST /api/apps/{id}/uploads/{upload_id}/finalize/ {"sha256": "<hex>"}
+        """
+        app = self.get_object()
+        try:
+            name = uploads.finish_upload(app, upload_id, request.data.get('sha256'))
+        except FileNotFoundError as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except uploads.OffsetMismatch as e:
+            return Response({'error': 'Upload is incomplete', 'offset': e.offset}, status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        app.build_file.name = name
+        app.save()  # Queues extraction through the post_save signal
+        return self._deploy_response(app, f"App '{app.name}' deployed successfully")
+
     @action(detail=True, methods=['post'])
     def undeploy(self, request, pk=None):
         """
@@ -150,19 +601,270 @@ class AppViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def restart(self, request, pk=None):
         """
-        Restart/redeploy the app (keep the same build).
+        Restart the app on its current build. The extracted build is simply
+        re-activated; the build file is only extracted again if that build
+        is no longer on disk.
         Endpoint: POST /api/apps/{id}/restart/
         """
         app = self.get_object()
+        if app.buildnumber in list_builds(app.name):
+            activate_build(app, app.buildnumber)
+            return Response(
+                {
+                    'message': f"App '{app.name}' restarted successfully",
+                    'app': AppSerializer(app).data
+                },
+                status=status.HTTP_200_OK
+            )
         if not app.build_file:
             return Response(
                 {'error': 'No build file to restart'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        app.save()  # Triggers the post_save signal
+        schedule_deploy(app)
+        return self._deploy_response(app, f"App '{app.name}' restarted successfully")
+
+    @action(detail=False, methods=['post'], url_path='bulk/deploy', parser_classes=(MultiPartParser, FormParser))
+    def bulk_deploy(self, request):
+        """
+        Deploy new build files to many apps at once, each uploaded in a form
+        field named after the app's id. Reports the outcome per app.
+        Endpoint: POST /api/apps/bulk/deploy/
+        """
+        uploaded = {_app_key(key): request.FILES[key] for key in request.FILES}
+        apps, results = self._bulk_apps(list(uploaded))
+        if apps is None:
+            return results
+        old_files = {app.pk: app.build_file.name for app in apps}
+
+        def store(app):
+            upload = uploaded[str(app.pk)]
+            try:
+                app.build_file.save(upload.name, upload, save=False)
+            except Exception as e:
+                return str(e)
+
+        errors = dict(zip([app.pk for app in apps], map_parallel(store, apps)))
+        stored = [app for app in apps if errors[app.pk] is None]
+        replaced = [old_files[app.pk] for app in stored if old_files[app.pk] not in ('', None, app.build_file.name)]
+        with transaction.atomic():
+            App.objects.bulk_update(stored, ['build_file'])
+            deployments = dict(zip([app.pk for app in stored], schedule_deploys(stored)))
+            transaction.on_commit(functools.partial(map_parallel, App.build_file.field.storage.delete, replaced))
+        for app in apps:
+            if errors[app.pk] is not None:
+                results[str(app.pk)] = self._bulk_result(
+                    app, status.HTTP_500_INTERNAL_SERVER_ERROR, error=f'Failed to store build file: {errors[app.pk]}'
+                )
+        results.update(self._bulk_deploy_results(stored, deployments, 'deployed'))
+        return self._bulk_response(results)
+
+    @action(detail=False, methods=['post'], url_path='bulk/restart', parser_classes=(JSONParser,))
+    def bulk_restart(self, request):
+        """
+        Restart many apps at once, like restart: retained builds are simply
+        re-activated, the others are extracted again from their build files.
+        Endpoint: POST /api/apps/bulk/restart/ {"ids": ["<app id>", ...]}
+        """
+        apps, results = self._bulk_apps(request.data.get('ids') if isinstance(request.data, dict) else None)
+        if apps is None:
+            return results
+        retained = map_parallel(lambda app: app.buildnumber in list_builds(app.name), apps)
+        reactivated = [app for app, kept in zip(apps, retained) if kept]
+        redeployed = [app for app, kept in zip(apps, retained) if not kept and app.build_file]
+
+        def reactivate(app):
+            # What restart does: under the deploy lock, with the caches told
+            try:
+                activate_build(app, app.buildnumber)
+            except ValueError as e:
+                return str(e)
+
+        errors = dict(zip([app.pk for app in reactivated], map_parallel(reactivate, reactivated)))
+        with transaction.atomic():
+            deployments = dict(zip([app.pk for app in redeployed], schedule_deploys(redeployed)))
+        for app, kept in zip(apps, retained):
+            if kept and errors[app.pk] is not None:
+                results[str(app.pk)] = self._bulk_result(app, status.HTTP_409_CONFLICT, error=errors[app.pk])
+            elif kept:
+                results[str(app.pk)] = self._bulk_result(
+                    app, status.HTTP_200_OK, message=f"App '{app.name}' restarted successfully"
+                )
+            elif not app.build_file:
+                results[str(app.pk)] = self._bulk_result(
+                    app, status.HTTP_400_BAD_REQUEST, error='No build file to restart'
+                )
+        results.update(self._bulk_deploy_results(redeployed, deployments, 'restarted'))
+        return self._bulk_response(results)
+
+    @action(detail=False, methods=['post'], url_path='bulk/undeploy', parser_classes=(JSONParser,))
+    def bulk_undeploy(self, request):
+        """
+        Remove many apps and all their artifacts at once.
+        Endpoint: POST /api/apps/bulk/undeploy/ {"ids": ["<app id>", ...]}
+        """
+        apps, results = self._bulk_apps(request.data.get('ids') if isinstance(request.data, dict) else None)
+        if apps is None:
+            return results
+        with deferred_removal() as removals, transaction.atomic():
+            App.objects.filter(pk__in=[app.pk for app in apps]).delete()
+        garbage = set().union(*map_parallel(lambda removal: remove_app_files(*removal), removals))
+        if garbage:
+            collect_garbage(garbage)
+        for app in apps:
+            results[str(app.pk)] = self._bulk_result(
+                app, status.HTTP_204_NO_CONTENT, message=f"App '{app.name}' undeployed successfully"
+            )
+        return self._bulk_response(results)
+
+    def _bulk_apps(self, ids):
+        """
+        Load the requester's apps among ids with a single query. Returns the
+        apps and a result for every id, already filled in for those that are
+        not the requester's, or (None, error response) for an invalid request.
+        """
+        if not isinstance(ids, list) or not ids:
+            return None, Response({'error': 'ids must list at least one app id'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > get_setting('BULK_MAX_APPS'):
+            return None, Response(
+                {'error': f"At most {get_setting('BULK_MAX_APPS')} apps per call"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        results = {}
+        for app_id in map(_app_key, ids):
+            results[app_id] = {'id': app_id, 'status': status.HTTP_404_NOT_FOUND, 'error': 'Not found.'}
+        apps = self.get_queryset().filter(pk__in=[app_id for app_id in results if UUID_RE.fullmatch(app_id)])
+        return list(apps), results
+
+    def _bulk_deploy_results(self, apps, deployments, verb):
+        """
+        Per-app results of deploys queued by schedule_deploys(): 202 with a
+        status URL when they run in the background, otherwise their outcome.
+        """
+        results = {}
+        if get_setting('DEPLOY_ASYNC'):
+            for app in apps:
+                status_url = reverse('app-deploy-status', args=[app.pk], request=self.request)
+                results[str(app.pk)] = self._bulk_result(
+                    app, status.HTTP_202_ACCEPTED, message=f"Deployment of app '{app.name}' queued",
+                    deployment=DeploymentSerializer(deployments[app.pk]).data,
+                    status_url=f'{status_url}?deployment={deployments[app.pk].pk}',
+                )
+            return results
+        current = App.objects.filter(pk__in=[app.pk for app in apps]).in_bulk()
+        for app in apps:
+            app = current.get(app.pk, app)
+            if app.status == 'failed':
+                results[str(app.pk)] = self._bulk_result(
+                    app, status.HTTP_500_INTERNAL_SERVER_ERROR, error=f"Failed to deploy app '{app.name}'"
+                )
+            else:
+                results[str(app.pk)] = self._bulk_result(
+                    app, status.HTTP_200_OK, message=f"App '{app.name}' {verb} successfully"
+                )
+        return results
+
+    def _bulk_result(self, app, code, **result):
+        result = {'id': str(app.pk), 'status': code, **result}
+        if code in (status.HTTP_200_OK, status.HTTP_202_ACCEPTED):
+            result['app'] = AppSerializer(app).data
+        return result
+
+    def _bulk_response(self, results):
+        return Response({'results': list(results.values())}, status=status.HTTP_207_MULTI_STATUS)
+
+    @action(detail=True, methods=['get'])
+    def builds(self, request, pk=None):
+        """
+        List the builds retained on disk, newest first.
+        Endpoint: GET /api/apps/{id}/builds/
+        """
+        app = self.get_object()
+        return Response(build_history(app), status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'], parser_classes=(JSONParser, MultiPartParser, FormParser))
+    def rollback(self, request, pk=None):
+        """
+        Switch the app back to a retained build without re-uploading or re-extracting it.
+        Defaults to the build before the active one.
+        Endpoint: POST /api/apps/{id}/rollback/ {"buildnumber": <optional>}
+        """
+        app = self.get_object()
+        buildnumber = request.data.get('buildnumber') or previous_build(app)
+        if buildnumber is None:
+            return Response(
+                {'error': 'No earlier build to roll back to'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            buildnumber = int(buildnumber)
+        except (TypeError, ValueError):
+            return Response({'error': 'buildnumber must be a build number'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            activate_build(app, buildnumber)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {
+                'message': f"App '{app.name}' rolled back to build {app.buildnumber}",
+                'app': AppSerializer(app).data
+            },
+            status=status.HTTP_200_OK
+        )
+
+    @action(detail=True, methods=['get'], url_path='status')
+    def deploy_status(self, request, pk=None):
+        """
+        Poll the state of the app and of its latest (or the given) deploy.
+        Endpoint: GET /api/apps/{id}/status/?deployment=<optional id>
+        """
+        app = self.get_object()
+        deployments = app.deployments.all()
+        if request.query_params.get('deployment'):
+            try:
+                deployments = deployments.filter(pk=int(request.query_params['deployment']))
+            except ValueError:
+                return Response(
+                    {'error': 'deployment must be a deployment id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        deployment = deployments.first()
+        return Response(
+            {
+                'status': app.status,
+                'buildnumber': app.buildnumber,
+                'last_deployed': app.last_deployed,
+                'deployment': DeploymentSerializer(deployment).data if deployment else None,
+            },
+            status=status.HTTP_200_OK
+        )
+
+    def _deploy_response(self, app, message):
+        """
+        202 with a status URL to poll while the deploy runs in the background,
+        or the outcome itself when deploys run inline.
+        """
+        if get_setting('DEPLOY_ASYNC'):
+            deployment = app.deployments.first()
+            status_url = reverse('app-deploy-status', args=[app.pk], request=self.request)
+            return Response(
+                {
+                    'message': f"Deployment of app '{app.name}' queued",
+                    'app': AppSerializer(app).data,
+                    'deployment': DeploymentSerializer(deployment).data,
+                    'status_url': f'{status_url}?deployment={deployment.pk}',
+                },
+                status=status.HTTP_202_ACCEPTED
+            )
+        app.refresh_from_db()
+        if app.status == 'failed':
+            return Response(
+                {'error': f"Failed to deploy app '{app.name}'"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
         return Response(
             {
-                'message': f"App '{app.name}' restarted successfully",
+                'message': message,
                 'app': AppSerializer(app).data
             },
             status=status.HTTP_200_OK
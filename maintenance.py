@@ -16,5 +16,24 @@ def clear_expired_entities():
     except Exception as e:
         logger.error(f"Error clearing entities: {e}")
 
+def reclaim_deployments():
+    from appmanager.builds import reclaim_stale_deployments
+    try:
+        logger.info(f"Reclaimed {reclaim_stale_deployments()} stale deployments")
+    except Exception as e:
+        logger.error(f"Error reclaiming deployments: {e}")
+
+def collect_blobs():
+    # Deploys and deletes only check the blobs of the builds they remove; this
+    # sweeps the whole store for anything those checks missed
+    from appmanager.blobs import collect_garbage
+    try:
+        collect_garbage()
+        logger.info("Collected unreferenced build blobs")
+    except Exception as e:
+        logger.error(f"Error collecting build blobs: {e}")
+
 if __name__ == "__main__":
-    clear_expired_entities()
\ No newline at end of file
+    clear_expired_entities()
+    reclaim_deployments()
+    collect_blobs()
\ No newline at end of file
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+class PycmsConfig(AppConfig):
+    name = 'pycms'
+
+    def ready(self):
+        # Connection setup (SQLITE_PRAGMAS) for the project's database
+        import pycms.db
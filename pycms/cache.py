@@ -0,0 +1,111 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded mapping with least-recently-used eviction.
+
+    When ``stamp_key`` is given the cache stays coherent across worker
+    processes: ``invalidate()`` bumps a generation stamp stored through
+    Django's cache framework and every other process drops its local entries
+    once it notices the new stamp (checked at most every ``check_interval``
+    seconds, so lookups never hit the shared cache on the hot path).
+    """
+
+    def __init__(self, maxsize=128, stamp_key=None, check_interval=1.0):
+        self.maxsize = maxsize
+        self.stamp_key = stamp_key
+        self.check_interval = check_interval
+        self.version = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._next_check = 0.0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        self._sync()
+        return self._lookup(key, default)
+
+    async def aget(self, key, default=None):
+        """
+        ``get()`` for async code: the generation stamp is read through the
+        async cache API, so a hit never blocks the event loop.
+        """
+        if self._check_due():
+            self._apply_stamp(await cache.aget(self.stamp_key))
+        return self._lookup(key, default)
+
+    def set(self, key, value, version=None):
+        """
+        Store ``value`` under ``key``. Passing the ``version`` read before the
+        value was computed discards the write if an invalidation happened in
+        the meantime, so a slow loader cannot resurrect stale data.
+        """
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._data.clear()
+
+    def invalidate(self, key=None):
+        """
+        Drop ``key`` (or everything) locally and tell the other processes to
+        drop their copies too.
+        """
+        with self._lock:
+            self.version += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+        if self.stamp_key:
+            self._stamp = uuid.uuid4().hex
+            cache.set(self.stamp_key, self._stamp, None)
+
+    def _lookup(self, key, default):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def _sync(self):
+        if self._check_due():
+            self._apply_stamp(cache.get(self.stamp_key))
+
+    def _check_due(self):
+        if not self.stamp_key:
+            return False
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        return True
+
+    def _apply_stamp(self, stamp):
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self.clear()
@@ -0,0 +1,50 @@
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Apply settings.SQLITE_PRAGMAS to every new SQLite connection, e.g. WAL
+    so readers are never blocked by a deploy writing to the database.
+    """
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None)
+    if not pragmas or connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_locked(error):
+    message = str(error).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_on_locked(func=None, *, using=DEFAULT_DB_ALIAS):
+    """
+    Run func again, with a growing jittered backoff, when SQLite reports
+    the database as locked, up to settings.SQLITE_WRITE_RETRIES times. Only
+    retried outside transactions: inside one, the whole transaction has to
+    be re-run, so the error is left to whoever started it.
+    """
+    if func is None:
+        return functools.partial(retry_on_locked, using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = getattr(settings, 'SQLITE_WRITE_RETRIES', 3)
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if attempt == retries or not is_locked(e) or connections[using].in_atomic_block:
+                    raise
+            time.sleep(random.uniform(0.5, 1.0) * 0.05 * 2 ** attempt)
+    return wrapper
@@ -41,10 +41,16 @@ ALLOWED_HOSTS = [
     'espy.pythonanywhere.com',
 ]
 
+# Hosted apps are also served on <subdomain>.<SUBDOMAIN_BASE_DOMAIN> when set
+SUBDOMAIN_BASE_DOMAIN = env('SUBDOMAIN_BASE_DOMAIN', default=None)
+if SUBDOMAIN_BASE_DOMAIN:
+    ALLOWED_HOSTS.append(f'.{SUBDOMAIN_BASE_DOMAIN}')
+
 
 # Application definition
 
 INSTALLED_APPS = [
+    'pycms',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -65,6 +71,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Last: app traffic on subdomains skips URL resolution and views, but its
+    # responses still get the security headers of the middleware above
+    'appmanager.middleware.SubdomainAppMiddleware',
 ]
 
 ROOT_URLCONF = 'pycms.urls'
@@ -112,6 +121,54 @@ DATABASES = {
     }
 }
 
+# Opt-in tuning for serving production traffic from SQLite (SQLITE_PRODUCTION=1);
+# `manage.py benchmark sqlite` compares it with the defaults
+SQLITE_PRODUCTION = env.bool('SQLITE_PRODUCTION', default=False)
+SQLITE_PRODUCTION_DATABASE = {
+    # Keep connections, and their page cache, across requests
+    'CONN_MAX_AGE': env.int('CONN_MAX_AGE', default=600),
+    'CONN_HEALTH_CHECKS': True,
+    # Writers take the lock when their transaction begins, so they queue on
+    # busy_timeout instead of failing when a read transaction upgrades
+    'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+}
+SQLITE_PRODUCTION_PRAGMAS = {
+    # Readers keep going while a deploy writes
+    'journal_mode': 'WAL',
+    # Durable at checkpoints; a power cut can only lose the last commits
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative: in KiB, so 64 MiB of page cache per connection
+    'cache_size': -64 * 1024,
+}
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update(SQLITE_PRODUCTION_DATABASE)
+# Applied to every new SQLite connection by pycms.db
+SQLITE_PRAGMAS = SQLITE_PRODUCTION_PRAGMAS if SQLITE_PRODUCTION else {}
+
+# Times pycms.db.retry_on_locked re-runs a write that found the database locked
+SQLITE_WRITE_RETRIES = 3
+
+# Cache
+# Must be shared between workers (file, redis, memcached...) so in-process
+# caches can broadcast invalidations to each other
+CACHES = {
+    'default': env.cache('CACHE_URL', default='filecache://' + os.path.join(BASE_DIR, 'cache')),
+}
+
+# Hosted apps: only what differs per deployment; everything else falls back
+# to appmanager.conf.DEFAULTS
+APP_MANAGER = {
+    # Run deploys on a background thread pool and answer 202 (see DEPLOY_STALE_AFTER)
+    "DEPLOY_ASYNC": env.bool('DEPLOY_ASYNC', default=False),
+    "SUBDOMAIN_BASE_DOMAIN": SUBDOMAIN_BASE_DOMAIN,
+    # Serve apps with the async view; enable when running under ASGI (pycms.asgi)
+    "ASYNC_SERVING": env.bool('ASYNC_SERVING', default=False),
+    # "nginx" or "apache" to let the web server send asset files
+    "SENDFILE_BACKEND": env('SENDFILE_BACKEND', default=None),
+}
+
 AUTH_USER_MODEL = 'users.User'
 
 LOGIN_URL = '/admin/login/'
@@ -133,12 +190,16 @@ AUTH_JWKS = {
     "CACHE_TTL": 300,
 }
 
+# Verified tokens remembered per worker, each for at most TOKEN_CACHE_TTL seconds
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE_TTL = 300
+
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "django_auth_jwks.authentication.JWTAuthentication",
+        "users.authentication.CachedJWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
         "rest_framework.authentication.BasicAuthentication",
     ],
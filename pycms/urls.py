@@ -19,13 +19,17 @@ from django.urls import path, re_path, include
 from django_sso_client_oauth import views as sso_views
 from django.http import HttpResponseRedirect
 from django.conf.urls.static import static
-from appmanager.views import serve_static_app
+from appmanager.conf import get_setting
+from appmanager.views import aserve_static_app, serve_static_app
 from rest_framework.routers import DefaultRouter
 from appmanager.views import AppViewSet
 
 def home_redirect(request):
     return HttpResponseRedirect(settings.HOME_URL)
 
+# The async view only pays off under ASGI; under WSGI every request would spin up an event loop
+serve_view = aserve_static_app if get_setting('ASYNC_SERVING') else serve_static_app
+
 router = DefaultRouter()
 router.register(r'apps', AppViewSet, basename='app')
 
@@ -36,13 +40,13 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     re_path(
         r'^apps/(?P<app_name>[^/]+)/(?P<subpath>.+?)/?$',
-        serve_static_app,
+        serve_view,
         name='serve_static_app'
     ),
 
     re_path(
         r'^apps/(?P<app_name>[^/]+)/?$',
-        serve_static_app,
+        serve_view,
         name='serve_static_app_root'
     ),
     path('api/', include(router.urls)),
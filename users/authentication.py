@@ -0,0 +1,62 @@
+import copy
+import hashlib
+import time
+from collections import namedtuple
+from django.conf import settings
+from django_auth_jwks.authentication import JWTAuthentication
+from django_auth_jwks.verifier import verify_token
+from pycms.cache import LRUCache
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+# A verified token: the user it maps to, its claims and when to verify it again
+TokenEntry = namedtuple('TokenEntry', ('user', 'claims', 'expires'))
+
+# sha256 of the token -> TokenEntry; cleared in every worker when a user changes
+_tokens = LRUCache(
+    maxsize=_setting('TOKEN_CACHE_SIZE', 1024),
+    stamp_key='users:tokens:stamp',
+    check_interval=1.0,
+)
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that remembers tokens it has already verified, so
+    repeat calls with the same token skip the signature check and the user
+    query. Entries last TOKEN_CACHE_TTL seconds at most and never outlive
+    the token's exp claim.
+    """
+
+    def authenticate(self, request):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return None
+        token = auth_header.split(' ')[1]
+        key = hashlib.sha256(token.encode()).hexdigest()
+        entry = _tokens.get(key)
+        if entry is not None and entry.expires <= time.time():
+            _tokens.pop(key)
+            entry = None
+        if entry is None:
+            version = _tokens.version
+            claims = verify_token(token)
+            entry = TokenEntry(self._get_user_from_claims(claims), claims, _expires(claims))
+            # A None user means the lookup failed, which is worth retrying
+            if entry.user is not None:
+                _tokens.set(key, entry, version=version)
+        # Requests get their own copies, so nothing a view does leaks into the cache
+        return copy.copy(entry.user), copy.deepcopy(entry.claims)
+
+def _expires(claims):
+    expires = time.time() + _setting('TOKEN_CACHE_TTL', 300)
+    exp = claims.get('exp')
+    if isinstance(exp, (int, float)):
+        expires = min(expires, exp)
+    return expires
+
+def invalidate_tokens():
+    """
+    Forget every verified token in this and every other worker.
+    """
+    _tokens.invalidate()
@@ -0,0 +1,21 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .authentication import invalidate_tokens
+from .models import User
+
+# Fields of the cached user row that decide what its tokens may do
+AUTH_FIELDS = {'username', 'password', 'is_active', 'is_staff', 'is_superuser'}
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_token_cache(sender, instance, update_fields=None, **kwargs):
+    # Partial saves that leave the auth fields alone, like the last_login
+    # update on every login, cannot change what a cached token resolves to
+    if update_fields is not None and not AUTH_FIELDS & set(update_fields):
+        return
+    # Cached tokens carry the user row they were resolved to (or a stateless
+    # stand-in for a user that did not exist yet), so drop them all, and again
+    # after the commit in case a request cached the old row in between
+    invalidate_tokens()
+    transaction.on_commit(invalidate_tokens)
@@ -1,3 +1,76 @@
-from django.test import TestCase
+import time
+from unittest import mock
+from django.contrib.auth.models import update_last_login
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+from .authentication import CachedJWTAuthentication, _tokens
+from .models import User
 
-# Create your tests here.
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        _tokens.clear()
+        self.user = User.objects.create_user(username='ci-bot')
+        self.claims = {'sub': 'ci-bot', 'exp': int(time.time()) + 3600}
+        patcher = mock.patch('users.authentication.verify_token', side_effect=lambda token: dict(self.claims))
+        self.verify = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def authenticate(self, token='token-1'):
+        request = APIRequestFactory().get('/api/apps/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return CachedJWTAuthentication().authenticate(request)
+
+    def test_repeat_calls_skip_verification_and_user_query(self):
+        user, claims = self.authenticate()
+        self.assertEqual(user, self.user)
+        with self.assertNumQueries(0):
+            user, claims = self.authenticate()
+        self.assertEqual(user, self.user)
+        self.assertEqual(claims['sub'], 'ci-bot')
+        self.assertEqual(self.verify.call_count, 1)
+        self.authenticate('token-2')
+        self.assertEqual(self.verify.call_count, 2)
+        self.assertIsNone(CachedJWTAuthentication().authenticate(APIRequestFactory().get('/api/apps/')))
+
+    def test_entries_expire_with_the_token(self):
+        self.claims['exp'] = int(time.time()) + 60
+        self.authenticate()
+        with mock.patch('users.authentication.time.time', return_value=self.claims['exp']):
+            self.authenticate()
+        self.assertEqual(self.verify.call_count, 2)
+
+    def test_user_changes_invalidate_entries(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        user, _ = self.authenticate()
+        self.assertFalse(user.is_active)
+        self.assertEqual(self.verify.call_count, 2)
+        # A token for a user that does not exist yet resolves to the real one once created
+        self.claims['sub'] = 'new-bot'
+        user, _ = self.authenticate('token-3')
+        self.assertNotIsInstance(user, User)
+        User.objects.create_user(username='new-bot')
+        user, _ = self.authenticate('token-3')
+        self.assertIsInstance(user, User)
+
+    def test_logins_keep_entries(self):
+        self.authenticate()
+        update_last_login(None, self.user)
+        self.user.first_name = 'CI'
+        self.user.save(update_fields=['first_name'])
+        self.authenticate()
+        self.assertEqual(self.verify.call_count, 1)
+        self.user.set_password('changed')
+        self.user.save(update_fields=['password'])
+        self.authenticate()
+        self.assertEqual(self.verify.call_count, 2)
+
+    def test_failed_verification_is_not_cached(self):
+        self.verify.side_effect = ValueError('Invalid token header')
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.authenticate()
+        self.assertEqual(self.verify.call_count, 2)